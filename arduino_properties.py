@@ -0,0 +1,40 @@
+"""
+Loads the Arduino platform properties files, platform.txt, boards.txt and programmers.txt, of every platform.
+
+The parser lives with the platform tools in platforms/dumfing-samd/tools/platform_properties.py, as they also run
+from an installed platform, which ships without the release scripts.
+"""
+import os
+import sys
+import os.path as path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), 'platforms', 'dumfing-samd', 'tools'))
+from platform_properties import Properties, load_properties
+
+def load_many(file_paths: Iterable[str]) -> Dict[str, Properties]:
+    """
+    Loads several properties files concurrently. Missing files are left out of the result.
+    """
+    file_paths = [file_path for file_path in file_paths if path.exists(file_path)]
+    with ThreadPoolExecutor() as pool:
+        return dict(zip(file_paths, pool.map(load_properties, file_paths)))
+
+def load_platforms(platforms_directory: str = 'platforms') -> Dict[str, Dict[str, Properties]]:
+    """
+    Loads platform.txt and boards.txt of every platform under a directory concurrently.
+
+    Returns:
+        dict: {platform: {'platform': Properties, 'boards': Properties}} for each platform that has a platform.txt.
+    """
+    names = {'platform': 'platform.txt', 'boards': 'boards.txt'}
+    platforms = sorted(os.listdir(platforms_directory))
+    loaded = load_many(path.join(platforms_directory, platform, file_name) for platform in platforms for file_name in names.values())
+
+    result = {}
+    for platform in platforms:
+        files = {kind: loaded.get(path.join(platforms_directory, platform, file_name)) for kind, file_name in names.items()}
+        if files['platform'] is not None:
+            result[platform] = files
+    return result
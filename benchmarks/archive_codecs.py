@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Compares compression time and archive size of each release archive codec on the platforms in this repository.
+
+Usage: python benchmarks/archive_codecs.py [--workers N] [--repeat N] [platform ...]
+"""
+import os
+import os.path as path
+import sys
+import time
+import argparse
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from platform_archive import ARCHIVE_CODECS, DigestCache, HashingWriter, hash_tree, write_archive
+
+class NullWriter:
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+def benchmark_codec(arcname, entries, codec, workers, repeat):
+    """
+    Returns the best wall time over repeat runs and the archive size for one codec.
+    """
+    best = None
+    for _ in range(repeat):
+        writer = HashingWriter(NullWriter())
+        start = time.perf_counter()
+        write_archive(writer, arcname, entries, codec, workers)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, writer.size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('platforms', nargs='*', help="platforms to benchmark, defaults to all of them")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="compression threads for the parallel runs")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per codec, the fastest is reported")
+    args = parser.parse_args()
+
+    root = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'platforms')
+    platforms = args.platforms or sorted(os.listdir(root))
+
+    row_format = '| {:24} | {:8} | {:>7} | {:>9} | {:>12} | {:>6} |'
+    print(row_format.format('Platform', 'Codec', 'Threads', 'Time', 'Size', 'Ratio'))
+    print('-' * 85)
+    for platform in platforms:
+        _, entries = hash_tree(path.join(root, platform), DigestCache())
+        input_size = sum(file_stat.st_size for _, _, file_stat in entries)
+        for codec in ARCHIVE_CODECS:
+            thread_counts = [1] if codec == 'zip' else sorted({1, args.workers})
+            for workers in thread_counts:
+                duration, size = benchmark_codec(platform, entries, codec, workers, args.repeat)
+                print(row_format.format(platform, codec, workers, f"{duration:.3f}s", f"{size:,}", f"{size / input_size:.1%}"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the parts of the GitHub REST API used by create_release.py.
+
+Implements listing releases (with Link pagination and ETags), creating releases, listing, downloading and
+deleting release assets, and uploading assets. Latency, upload bandwidth, upload failures and dropped upload
+connections can be injected.
+
+Point create_release at it with GH_API_URL=http://HOST:PORT/api and GH_UPLOADS_URL=http://HOST:PORT/uploads.
+
+Usage: python benchmarks/mock_github.py [--port 8000] [--latency 0.05] [--bandwidth 1e6] [--failure-rate 0.1] [--drop-rate 0.1]
+"""
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+from aiohttp import web
+
+class MockGitHub:
+    """
+    In-memory GitHub releases API.
+
+    Args:
+        latency (float): Seconds added before every response.
+        bandwidth (float): Upload bandwidth limit in bytes per second, or None for unlimited.
+        failure_rate (float): Probability that an upload is answered with a 502 after its body was received.
+        seed (int): Seed for the failure injection.
+        drop_rate (float): Probability that an upload connection is closed without a response after its body was
+            received, leaving the asset behind in the 'starter' state as GitHub does.
+    """
+    def __init__(self, latency=0.0, bandwidth=None, failure_rate=0.0, seed=0, drop_rate=0.0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.releases = []
+        # contents of uploaded JSON assets, the only ones create_release downloads again
+        self.contents = {}
+        self.next_id = 1
+        self.bytes_received = 0
+        self.requests = {}
+        self.failed_uploads = 0
+        self.dropped_uploads = 0
+        self.runner = None
+        self.url = None
+
+        self.app = web.Application(client_max_size=1024 ** 3, middlewares=[self.count_and_delay])
+        self.app.router.add_get('/api/releases', self.list_releases)
+        self.app.router.add_post('/api/releases', self.create_release)
+        self.app.router.add_get('/api/releases/{release_id}/assets', self.list_assets)
+        self.app.router.add_get('/api/releases/assets/{asset_id}', self.download_asset)
+        self.app.router.add_delete('/api/releases/assets/{asset_id}', self.delete_asset)
+        self.app.router.add_post('/uploads/releases/{release_id}/assets', self.upload_asset)
+
+    @web.middleware
+    async def count_and_delay(self, request, handler):
+        key = f"{request.method} {request.match_info.route.resource.canonical if request.match_info.route.resource else request.path}"
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    def add_release(self, tag_name, asset_names, draft=False):
+        """
+        Adds a pre-existing release with already uploaded assets of zero size.
+        """
+        release = {'id': self.next_id, 'tag_name': tag_name, 'draft': draft, 'assets': []}
+        self.next_id += 1
+        for name in asset_names:
+            release['assets'].append({'id': self.next_id, 'url': self.asset_url(self.next_id), 'name': name, 'state': 'uploaded', 'size': 0})
+            self.next_id += 1
+        self.releases.insert(0, release)
+        return release
+
+    def asset_url(self, asset_id):
+        return f"{self.url}/api/releases/assets/{asset_id}"
+
+    def find_release(self, release_id):
+        for release in self.releases:
+            if release['id'] == int(release_id):
+                return release
+        raise web.HTTPNotFound()
+
+    async def list_releases(self, request):
+        per_page = int(request.query.get('per_page', 30))
+        page = int(request.query.get('page', 1))
+        authenticated = 'Authorization' in request.headers
+        visible = [release for release in self.releases if authenticated or not release['draft']]
+        body = json.dumps(visible[(page - 1) * per_page:page * per_page])
+
+        etag = '"{}"'.format(hashlib.sha256(body.encode()).hexdigest()[:32])
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+
+        last_page = max(1, (len(visible) + per_page - 1) // per_page)
+        headers = {'ETag': etag}
+        if last_page > 1:
+            # request.url is rebuilt from the Host header, which yarl rejects with a port in some versions
+            base = f"{self.url}{request.path}"
+            links = []
+            if page < last_page:
+                links.append(f'<{base}?per_page={per_page}&page={page + 1}>; rel="next"')
+            links.append(f'<{base}?per_page={per_page}&page={last_page}>; rel="last"')
+            headers['Link'] = ', '.join(links)
+        return web.Response(text=body, content_type='application/json', headers=headers)
+
+    async def create_release(self, request):
+        body = json.loads(await request.read())
+        release = self.add_release(body['tag_name'], [], draft=body.get('draft', False))
+        release.update({'name': body.get('name'), 'body': body.get('body')})
+        return web.json_response(release, status=201)
+
+    async def list_assets(self, request):
+        return web.json_response(self.find_release(request.match_info['release_id'])['assets'])
+
+    async def download_asset(self, request):
+        asset_id = int(request.match_info['asset_id'])
+        if asset_id not in self.contents:
+            raise web.HTTPNotFound()
+        return web.Response(body=self.contents[asset_id], content_type='application/octet-stream')
+
+    async def delete_asset(self, request):
+        asset_id = int(request.match_info['asset_id'])
+        for release in self.releases:
+            release['assets'] = [asset for asset in release['assets'] if asset['id'] != asset_id]
+        return web.Response(status=204)
+
+    async def upload_asset(self, request):
+        release = self.find_release(request.match_info['release_id'])
+        name = request.query['name']
+        size = 0
+        digest = hashlib.sha256()
+        content = bytearray() if name.endswith('.json') else None
+        started = asyncio.get_running_loop().time()
+        async for chunk in request.content.iter_any():
+            size += len(chunk)
+            digest.update(chunk)
+            if content is not None:
+                content += chunk
+            self.bytes_received += len(chunk)
+            if self.bandwidth:
+                # sleep until the bytes received so far fit within the bandwidth limit
+                delay = size / self.bandwidth - (asyncio.get_running_loop().time() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self.failed_uploads += 1
+            return web.Response(status=502, text='injected failure')
+        if any(asset['name'] == name for asset in release['assets']):
+            return web.json_response({'message': 'Validation Failed', 'errors': [{'code': 'already_exists'}]}, status=422)
+
+        asset = {'id': self.next_id, 'url': self.asset_url(self.next_id), 'name': name, 'state': 'uploaded', 'size': size, 'sha256': digest.hexdigest()}
+        self.next_id += 1
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.dropped_uploads += 1
+            asset['state'] = 'starter'
+            release['assets'].append(asset)
+            request.transport.close()
+            return web.Response(status=500)
+        if content is not None:
+            self.contents[asset['id']] = bytes(content)
+        release['assets'].append(asset)
+        return web.json_response(asset, status=201)
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Starts serving and sets self.url to the server's base URL.
+        """
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{bound_port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def environment(self):
+        """
+        Returns the environment variables that point create_release at this server.
+        """
+        return {'GH_API_URL': f"{self.url}/api", 'GH_UPLOADS_URL': f"{self.url}/uploads"}
+
+async def serve(args):
+    server = MockGitHub(args.latency, args.bandwidth, args.failure_rate, args.seed, args.drop_rate)
+    await server.start(args.host, args.port)
+    for key, value in server.environment().items():
+        print(f"{key}={value}")
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the GitHub releases API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--bandwidth', type=float, default=None, help="upload bandwidth limit in bytes per second")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of uploads answered with 502")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="fraction of uploads whose connection is dropped, leaving an incomplete asset")
+    parser.add_argument('--seed', type=int, default=0)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
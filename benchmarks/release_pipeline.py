@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of create_release.main() against the local GitHub stand-in in mock_github.py.
+
+Synthetic platform trees of increasing size and count are generated from the real platforms/ tree. Each scenario
+runs create_release in a fresh subprocess so peak RSS is measured per run, and reports the wall time of each stage,
+the peak RSS of the release process and its archiving workers, and the bytes received by the mock upload endpoint.
+
+Usage: python benchmarks/release_pipeline.py [--sizes 1,8,32] [--counts 1,2,4] [--latency 0.05] [--bandwidth 5e6]
+"""
+import os
+import os.path as path
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+
+BENCHMARK_DIR = path.dirname(path.abspath(__file__))
+REPO_ROOT = path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from mock_github import MockGitHub
+
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+STAGES = ('get_release_pages', 'get_commited_versions', 'validate_release', 'create_release', 'build_manifest', 'release_pipeline', 'upload_manifest')
+
+def make_platform(source, destination, size_mb, seed):
+    """
+    Creates a synthetic platform from the metadata of a real one plus size_mb of filler sources.
+
+    The filler is a mix of repeated source text and random bytes so it compresses roughly like the real tree.
+    """
+    os.makedirs(destination)
+    for name in ('platform.txt', 'boards.txt', 'architecture.txt'):
+        shutil.copy(path.join(source, name), destination)
+    # boards.txt names these, and create_release validates them before archiving
+    for name in ('cores', 'variants', 'bootloaders'):
+        shutil.copytree(path.join(source, name), path.join(destination, name))
+
+    generator = random.Random(seed)
+    text = open(path.join(source, 'platform.txt'), 'rb').read()
+    library = path.join(destination, 'libraries', 'Synthetic', 'src')
+    os.makedirs(library)
+    remaining = int(size_mb * 1024 * 1024)
+    index = 0
+    while remaining > 0:
+        chunk = min(remaining, 256 * 1024)
+        data = (text * (chunk // len(text) + 1))[:chunk * 3 // 4] + generator.randbytes(chunk - chunk * 3 // 4)
+        with open(path.join(library, f"file{index:04}.c"), 'wb') as f:
+            f.write(data)
+        remaining -= chunk
+        index += 1
+
+def run_scenario():
+    """
+    Runs create_release.main() in the current directory and prints the stage timings from its trace as the last output line.
+    """
+    import create_release
+
+    start = time.perf_counter()
+    asyncio.run(create_release.main())
+    timings = {'total': time.perf_counter() - start}
+    for event in create_release.tracer.events:
+        if event['cat'] == 'stage':
+            timings[event['name']] = timings.get(event['name'], 0) + event['dur'] / 1e6
+
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(RESULT_PREFIX + json.dumps({'stages': timings, 'counters': create_release.tracer.counters, 'peak_rss_kb': peak_rss}))
+
+async def run_benchmark(args):
+    source = path.join(REPO_ROOT, 'platforms', args.source)
+    row_format = '| {:>6} | {:>5} | ' + ' | '.join(['{:>9}'] * (len(STAGES) + 1)) + ' | {:>9} | {:>11} |'
+    headers = ['MB', 'Count', 'released', 'commited', 'validate', 'release', 'manifest', 'pipeline', 'upload mf', 'total', 'RSS MB', 'Sent']
+    print(row_format.format(*headers))
+    print('-' * len(row_format.format(*headers)))
+
+    for size_mb in args.sizes:
+        for count in args.counts:
+            with tempfile.TemporaryDirectory() as work_dir:
+                for n in range(count):
+                    make_platform(source, path.join(work_dir, 'platforms', f"synthetic-{n}"), size_mb, seed=n)
+
+                server = MockGitHub(args.latency, args.bandwidth, args.failure_rate, drop_rate=args.drop_rate)
+                await server.start()
+                environment = {**os.environ, **server.environment(), 'GH_API_TOKEN': 'benchmark',
+                               'RELEASE_CACHE_DIR': path.join(work_dir, '.release_cache'),
+                               'PYTHONPATH': REPO_ROOT}
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, path.abspath(__file__), '--run-scenario', cwd=work_dir, env=environment,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+                output, _ = await process.communicate()
+                await server.stop()
+
+            lines = output.decode().splitlines()
+            results = [line for line in lines if line.startswith(RESULT_PREFIX)]
+            if process.returncode != 0 or not results:
+                print('\n'.join(lines[-20:]))
+                raise SystemExit(f"Scenario {size_mb} MB x {count} failed")
+
+            result = json.loads(results[-1][len(RESULT_PREFIX):])
+            stages = [f"{result['stages'].get(stage, 0):.3f}s" for stage in STAGES + ('total',)]
+            print(row_format.format(size_mb, count, *stages, f"{result['peak_rss_kb'] / 1024:.1f}", f"{server.bytes_received:,}"))
+
+def parse_list(value, kind):
+    return [kind(item) for item in value.split(',') if item]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark create_release.py against a local GitHub stand-in")
+    parser.add_argument('--sizes', type=lambda value: parse_list(value, float), default=[1, 8, 32], help="synthetic filler per platform in MB")
+    parser.add_argument('--counts', type=lambda value: parse_list(value, int), default=[1, 2, 4], help="numbers of platforms to release")
+    parser.add_argument('--source', default='dumfing-samd', help="platform whose metadata is copied into the synthetic platforms")
+    parser.add_argument('--latency', type=float, default=0.05, help="mock API latency in seconds")
+    parser.add_argument('--bandwidth', type=float, default=None, help="mock upload bandwidth in bytes per second")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of uploads answered with 502")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="fraction of uploads whose connection is dropped, leaving an incomplete asset")
+    parser.add_argument('--run-scenario', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        run_scenario()
+    else:
+        asyncio.run(run_benchmark(args))
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Local caching mirror of the Boards Manager package index published by create_release.py and the archives it lists.
+
+Archives are kept in a content-addressed store, one file per SHA-256, and are only stored after their checksum and
+size match the package index. The index is served with its URLs rewritten to the mirror, so every build machine
+installs the platform and its tools from the local network and the internet is only used once per archive.
+
+The tools the platforms depend on from other packagers, such as the compiler, bossac and CMSIS of the arduino package,
+are looked up in the upstream index (--upstream-index-url, the Arduino one by default) and mirrored like the platform
+archives, listed in the served index as a package of that packager holding only those tool versions. arduino-cli reads
+the additional indexes after its own, so their mirrored URLs take precedence over the upstream ones.
+
+    python boards_mirror.py sync [--store .boards_mirror] [--index-url URL]
+    python boards_mirror.py serve [--store .boards_mirror] [--port 8080] [--sync] [--offline]
+
+and on the build machines
+
+    arduino-cli core update-index --additional-urls http://MIRROR:8080/package_dumfing_index.json
+
+or tools/build_all.py --additional-urls http://MIRROR:8080/package_dumfing_index.json, which does the same.
+
+`sync` downloads the index and every archive it lists, for machines that will be offline. `serve` answers archive
+requests from the store, and unless --offline fetches archives it does not have yet on the first request for them,
+sharing one download between concurrent requests. Archives are served with Range and conditional request support.
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import os.path as path
+import aiohttp
+from aiohttp import web
+from typing import Dict, List, Optional, Set, Tuple
+
+from create_release import PACKAGE_INDEX_NAME, create_session, find_package_index_asset, get_release_pages, github_headers, load_json_cache
+from package_index import PACKAGE_NAME
+from platform_archive import write_atomic
+
+MIRROR_STORE = os.environ.get('BOARDS_MIRROR_STORE', '.boards_mirror')
+# arduino-cli saves additional indexes under their URL's file name, so the mirror's must not be package_index.json
+MIRROR_INDEX_NAME = f"package_{PACKAGE_NAME}_index.json"
+# The index of the packagers whose tools the platforms depend on
+UPSTREAM_INDEX_URL = os.environ.get('BOARDS_MIRROR_UPSTREAM_INDEX', 'https://downloads.arduino.cc/packages/package_index.json')
+MAX_CONCURRENT_DOWNLOADS = 4
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+def parse_checksum(checksum: str) -> Optional[str]:
+    """
+    Returns the hex digest of a package index 'SHA-256:...' checksum, or None for other algorithms.
+    """
+    algorithm, _, digest = checksum.partition(':')
+    digest = digest.lower()
+    return digest if algorithm == 'SHA-256' and SHA256_PATTERN.match(digest) else None
+
+def index_archives(index) -> Dict[str, dict]:
+    """
+    Collects the archives a package index lists, for platforms and for every host of every tool.
+
+    Returns:
+        dict: The archive entries of the index, indexed by their SHA-256. Entries with no SHA-256 are left out.
+    """
+    archives = {}
+    for package in index.get('packages', []):
+        entries = list(package.get('platforms', []))
+        for tool in package.get('tools', []):
+            entries.extend(tool.get('systems', []))
+        for entry in entries:
+            sha256 = parse_checksum(entry.get('checksum', ''))
+            if sha256 is not None:
+                archives[sha256] = entry
+    return archives
+
+def foreign_dependencies(index) -> Set[Tuple[str, str, str]]:
+    """
+    Returns the tools the platforms of a package index depend on from other packagers, as (packager, name, version).
+    """
+    own = {package.get('name') for package in index.get('packages', [])}
+    return {(dependency.get('packager'), dependency.get('name'), dependency.get('version'))
+            for package in index.get('packages', []) for platform in package.get('platforms', [])
+            for dependency in platform.get('toolsDependencies', []) if dependency.get('packager') not in own}
+
+def dependency_packages(upstream, dependencies: Set[Tuple[str, str, str]]) -> Tuple[List[dict], List[str]]:
+    """
+    Picks tool releases out of an upstream package index.
+
+    Args:
+        upstream (dict): The package index of the other packagers.
+        dependencies (set): The tools to pick, as returned by foreign_dependencies.
+
+    Returns:
+        tuple: A package for each packager, holding only the picked tools, and the dependencies the upstream index
+        does not list, as 'packager:name@version' strings.
+    """
+    packages = []
+    found = set()
+    for package in upstream.get('packages', []):
+        tools = [tool for tool in package.get('tools', []) if (package.get('name'), tool.get('name'), tool.get('version')) in dependencies]
+        if tools:
+            packages.append({**{key: value for key, value in package.items() if key not in ('platforms', 'tools')}, 'platforms': [], 'tools': tools})
+            found.update((package.get('name'), tool.get('name'), tool.get('version')) for tool in tools)
+    missing = [f"{packager}:{name}@{version}" for packager, name, version in sorted(dependencies - found)]
+    return packages, missing
+
+class BoardsMirror:
+    """
+    A content-addressed store of Boards Manager archives, and the package index they were listed in.
+
+    Args:
+        store (str): The store directory. The index is kept in it as package_index.json and the archives in objects/.
+        upstream_index_url (str): The index listing the tools the platforms depend on from other packagers.
+    """
+    def __init__(self, store: str = MIRROR_STORE, upstream_index_url: str = UPSTREAM_INDEX_URL):
+        self.store = store
+        self.upstream_index_url = upstream_index_url
+        self.objects = path.join(store, 'objects')
+        self.index_file = path.join(store, PACKAGE_INDEX_NAME)
+        self.state_file = path.join(store, 'state.json')
+        self.index = load_json_cache(self.index_file) or None
+        self.archives = index_archives(self.index) if self.index else {}
+        self.downloads: Dict[str, asyncio.Future] = {}
+        self.served_indexes: Dict[str, tuple] = {}
+        os.makedirs(self.objects, exist_ok=True)
+
+    def object_path(self, sha256: str):
+        return path.join(self.objects, sha256)
+
+    def has_object(self, sha256: str):
+        return path.exists(self.object_path(sha256))
+
+    async def sync_index(self, session: aiohttp.ClientSession, index_url: str = None):
+        """
+        Fetches the package index, from index_url or else from the newest release that has one, and adds the tools
+        its platforms depend on from the upstream index.
+
+        The index is revalidated with its ETag, so an unchanged index costs a single 304 response, and the upstream
+        index is only downloaded along with a changed one.
+
+        Returns:
+            bool: Whether the index changed.
+        """
+        headers = {}
+        if index_url is None:
+            index_url = find_package_index_asset(await get_release_pages(session))
+            if index_url is None:
+                raise RuntimeError("No release has a package index to mirror")
+            headers = github_headers(accept='application/octet-stream')
+        state = load_json_cache(self.state_file)
+        if self.index is not None and state.get('source') == index_url and state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+
+        async with session.get(index_url, headers=headers) as req:
+            if req.status == 304:
+                return False
+            req.raise_for_status()
+            data = await req.read()
+            etag = req.headers.get('ETag')
+        index = json.loads(data)
+        index['packages'] = index.get('packages', []) + await self.fetch_dependencies(session, index)
+        await asyncio.to_thread(write_atomic, self.index_file, json.dumps(index).encode())
+        await asyncio.to_thread(write_atomic, self.state_file, json.dumps({'source': index_url, 'etag': etag}).encode())
+        self.index = index
+        self.archives = index_archives(index)
+        self.served_indexes.clear()
+        return True
+
+    async def fetch_dependencies(self, session: aiohttp.ClientSession, index):
+        """
+        Returns the packages holding the tools the platforms of the index depend on from other packagers.
+        """
+        dependencies = foreign_dependencies(index)
+        if not dependencies:
+            return []
+        async with session.get(self.upstream_index_url) as req:
+            req.raise_for_status()
+            upstream = json.loads(await req.read())
+        packages, missing = dependency_packages(upstream, dependencies)
+        for dependency in missing:
+            print(f"{dependency} is not listed in {self.upstream_index_url}, it will not be mirrored")
+        return packages
+
+    async def download(self, session: aiohttp.ClientSession, sha256: str):
+        """
+        Downloads one archive of the index into the store, verifying its SHA-256 and size before it becomes visible.
+
+        The file is written on worker threads, so the downloads do not hold up the event loop, which also serves the
+        mirror.
+        """
+        entry = self.archives[sha256]
+        temporary = f"{self.object_path(sha256)}.{os.getpid()}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with session.get(entry['url']) as req:
+                req.raise_for_status()
+                f = await asyncio.to_thread(open, temporary, 'wb')
+                try:
+                    async for chunk in req.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+            if digest.hexdigest() != sha256:
+                raise ValueError(f"{entry['archiveFileName']} has SHA-256 {digest.hexdigest()}, the index lists {sha256}")
+            if 'size' in entry and size != int(entry['size']):
+                raise ValueError(f"{entry['archiveFileName']} is {size} bytes, the index lists {entry['size']}")
+            await asyncio.to_thread(os.replace, temporary, self.object_path(sha256))
+        finally:
+            if path.exists(temporary):
+                await asyncio.to_thread(os.remove, temporary)
+        print(f"Stored {entry['archiveFileName']} ({size} bytes)")
+
+    async def ensure(self, session: aiohttp.ClientSession, sha256: str):
+        """
+        Makes sure an archive is in the store, downloading it once however many callers ask for it at the same time.
+        """
+        if self.has_object(sha256):
+            return
+        if sha256 not in self.downloads:
+            self.downloads[sha256] = asyncio.ensure_future(self.download(session, sha256))
+        try:
+            await asyncio.shield(self.downloads[sha256])
+        finally:
+            if self.downloads.get(sha256) is not None and self.downloads[sha256].done():
+                del self.downloads[sha256]
+
+    async def sync(self, session: aiohttp.ClientSession, index_url: str = None, max_concurrent=MAX_CONCURRENT_DOWNLOADS):
+        """
+        Fetches the package index and every archive it lists that is not in the store yet.
+
+        Returns:
+            int: The number of archives that could not be stored.
+        """
+        await self.sync_index(session, index_url)
+        missing = [sha256 for sha256 in self.archives if not self.has_object(sha256)]
+        print(f"{len(self.archives) - len(missing)} of {len(self.archives)} archives already stored")
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def fetch(sha256):
+            async with semaphore:
+                await self.ensure(session, sha256)
+
+        results = await asyncio.gather(*(fetch(sha256) for sha256 in missing), return_exceptions=True)
+        failures = [(sha256, result) for sha256, result in zip(missing, results) if isinstance(result, Exception)]
+        for sha256, error in failures:
+            print(f"Could not store {self.archives[sha256]['archiveFileName']}: {error}")
+        return len(failures)
+
+    def served_index(self, base_url: str, available_only: bool):
+        """
+        Returns the package index with every archive URL pointing at the mirror, and its ETag.
+
+        Args:
+            base_url (str): The URL the mirror is reached at.
+            available_only (bool): Leave out the platforms and tool hosts whose archives are not stored, for a mirror
+                that cannot download them.
+        """
+        key = (base_url, available_only, len(os.listdir(self.objects)) if available_only else 0)
+        if key not in self.served_indexes:
+            index = json.loads(json.dumps(self.index))
+            for package in index.get('packages', []):
+                package['platforms'] = [entry for entry in package.get('platforms', []) if self.mirror_entry(entry, base_url, available_only)]
+                for tool in package.get('tools', []):
+                    tool['systems'] = [entry for entry in tool.get('systems', []) if self.mirror_entry(entry, base_url, available_only)]
+            data = json.dumps(index, indent=2).encode()
+            self.served_indexes[key] = (data, f'"{hashlib.sha256(data).hexdigest()}"')
+        return self.served_indexes[key]
+
+    def mirror_entry(self, entry: dict, base_url: str, available_only: bool):
+        sha256 = parse_checksum(entry.get('checksum', ''))
+        if sha256 is None or (available_only and not self.has_object(sha256)):
+            return False
+        entry['url'] = f"{base_url}/objects/{sha256}/{entry['archiveFileName']}"
+        return True
+
+class MirrorServer:
+    """
+    Serves a BoardsMirror over HTTP.
+
+    Args:
+        mirror (BoardsMirror): The store to serve.
+        offline (bool): Only serve archives already in the store, instead of downloading missing ones on request.
+        base_url (str): The URL clients reach the mirror at. Defaults to the scheme and Host of each request.
+    """
+    def __init__(self, mirror: BoardsMirror, offline=False, base_url: str = None):
+        self.mirror = mirror
+        self.offline = offline
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.session = None
+        self.runner = None
+        self.app = web.Application()
+        self.app.router.add_get(f'/{MIRROR_INDEX_NAME}', self.get_index)
+        self.app.router.add_get(f'/{PACKAGE_INDEX_NAME}', self.get_index)
+        self.app.router.add_get('/objects/{sha256}/{filename}', self.get_object)
+
+    async def get_index(self, request: web.Request):
+        if self.mirror.index is None:
+            raise web.HTTPServiceUnavailable(text="The mirror has no package index yet, run boards_mirror.py sync\n")
+        base_url = self.base_url or f"{request.scheme}://{request.host}"
+        data, etag = self.mirror.served_index(base_url, self.offline)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=data, content_type='application/json', headers=headers)
+
+    async def get_object(self, request: web.Request):
+        sha256 = request.match_info['sha256']
+        if not SHA256_PATTERN.match(sha256):
+            raise web.HTTPNotFound()
+        if not self.mirror.has_object(sha256):
+            if self.offline or sha256 not in self.mirror.archives:
+                raise web.HTTPNotFound()
+            try:
+                await self.mirror.ensure(self.session, sha256)
+            except (aiohttp.ClientError, ValueError) as e:
+                print(f"Could not store {self.mirror.archives[sha256]['archiveFileName']}: {e}")
+                raise web.HTTPBadGateway()
+
+        # objects never change, so their digest is a strong validator and they can be cached forever
+        etag = f'"{sha256}"'
+        headers = {'ETag': etag, 'Cache-Control': 'public, max-age=31536000, immutable', 'Content-Type': 'application/octet-stream'}
+        if etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+        # FileResponse answers Range, If-Range and If-Modified-Since requests
+        return web.FileResponse(self.mirror.object_path(sha256), headers=headers)
+
+    async def start(self, host='0.0.0.0', port=8080):
+        self.session = create_session()
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+async def sync(args):
+    mirror = BoardsMirror(args.store, args.upstream_index_url)
+    async with create_session() as session:
+        failures = await mirror.sync(session, args.index_url)
+    return 1 if failures else 0
+
+async def serve(args):
+    mirror = BoardsMirror(args.store, args.upstream_index_url)
+    if args.sync:
+        async with create_session() as session:
+            await mirror.sync_index(session, args.index_url)
+    server = MirrorServer(mirror, args.offline, args.base_url)
+    url = await server.start(args.host, args.port)
+    print(f"Serving {url}/{MIRROR_INDEX_NAME}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local caching mirror of the Boards Manager package index and archives")
+    parser.add_argument('--store', default=MIRROR_STORE, help="content-addressed store directory (default: %(default)s)")
+    parser.add_argument('--index-url', help="package index to mirror (default: the one of the newest release)")
+    parser.add_argument('--upstream-index-url', default=UPSTREAM_INDEX_URL, help="index of the tools the platforms depend on from other packagers (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('sync', help="download the package index and every archive it lists")
+    serve_parser = commands.add_parser('serve', help="serve the store over HTTP")
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--base-url', help="URL the build machines reach the mirror at (default: the Host of each request)")
+    serve_parser.add_argument('--sync', action='store_true', help="refresh the package index before serving")
+    serve_parser.add_argument('--offline', action='store_true', help="only serve archives already in the store")
+    args = parser.parse_args()
+
+    try:
+        sys.exit(asyncio.run(sync(args) if args.command == 'sync' else serve(args)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
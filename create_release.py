@@ -1,3 +1,4 @@
+import re
 import json
 import asyncio
 import aiohttp
@@ -6,80 +7,229 @@ import aiofiles.os
 import aiofiles.tempfile
 import os.path as path
 import os
-import tarfile
-import hashlib
-from typing import Dict, Union, List
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Union, List, Set, Tuple
+from arduino_properties import load_platforms
+from release_trace import tracer
+from package_index import add_platforms, add_tools, has_tool, load_split_packaging, load_tools_dependencies, new_package_index, platform_entry, tool_entry, write_package_index
+from platform_archive import ARCHIVE_CODECS, DigestCache, build_platform_archive, hash_tree, write_atomic
+from validate_platforms import VERSION_PATTERN, validate_platforms, version_ordering
+
+API_URL = os.environ.get('GH_API_URL', 'https://api.github.com/repos/AaronLi/Arduino-Boards')
+UPLOADS_URL = os.environ.get('GH_UPLOADS_URL', 'https://uploads.github.com/repos/AaronLi/Arduino-Boards')
+
+RELEASE_CACHE_DIR = os.environ.get('RELEASE_CACHE_DIR', '.release_cache')
+ARCHIVE_CODEC = os.environ.get('ARCHIVE_CODEC', 'bz2')
+TRACE_FILE = os.environ.get('RELEASE_TRACE_FILE')
+
+MAX_CONNECTIONS = 8
+MAX_CONCURRENT_UPLOADS = 4
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_RETRIES = 4
+UPLOAD_BACKOFF = 1.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DOWNLOAD_URL = os.environ.get('GH_DOWNLOAD_URL', 'https://github.com/AaronLi/Arduino-Boards/releases/download')
+PACKAGE_INDEX_NAME = 'package_index.json'
+# Bump when the cached release page layout changes
+RELEASE_CACHE_FORMAT = 3
+
+ASSET_NAME_PATTERN = re.compile(r'^(?P<version>\d+(?:\.\d+)*)_(?P<sha256>[0-9a-f]{64})_(?P<platform>[^.]+)\.(?P<extension>.+)$')
+# Subtrees published as separate tools are named {tool}_{tree hash prefix}.{extension}
+TOOL_ASSET_PATTERN = re.compile(r'^(?P<tool>[^_]+)_(?P<tree_hash>[0-9a-f]{16})\.(?P<extension>.+)$')
+TREE_HASH_LENGTH = 16
+
+def is_content_addressed(name: str):
+    """
+    Returns whether an asset name carries the hash of its contents, so an uploaded asset of that name and size is
+    known to be identical. The package index and the manifest keep their names when their contents change.
+    """
+    return bool(ASSET_NAME_PATTERN.match(name) or TOOL_ASSET_PATTERN.match(name))
 
-def version_ordering(a: List[int], b: List[int]):
+def parse_asset_name(name: str):
     """
-    Compares two version numbers represented as lists of integers.
+    Parses a release asset name of the form {version}_{sha256}_{platform}.{extension}.
 
     Args:
-        a (list): The first version number.
-        b (list): The second version number.
+        name (str): The asset name.
 
     Returns:
-        int: -1 if a < b, 0 if a == b, 1 if a > b.
+        tuple: The version as a list of integers, the sha256, the platform and the extension, or None if the name does not match.
     """
-    for a_sub_version, b_sub_version in zip(a, b):
-        if a_sub_version < b_sub_version:
-            return -1
-        elif a_sub_version > b_sub_version:
-            return 1
-    return 0
+    match = ASSET_NAME_PATTERN.match(name)
+    if match is None:
+        return None
+    return list(map(int, match['version'].split('.'))), match['sha256'], match['platform'], match['extension']
 
-async def get_released_versions(session: aiohttp.ClientSession, per_page=30):
+def load_json_cache(cache_file: str):
+    """
+    Loads a JSON cache file, returning an empty cache if it is missing or unreadable.
+    """
+    if not cache_file or not path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+async def fetch_release_page(session: aiohttp.ClientSession, page: int, per_page: int, cached_page: dict = None):
+    """
+    Fetches one page of the release list, revalidating a cached copy with its ETag.
+
+    Args:
+        page (int): The 1-based page number.
+        per_page (int): The number of releases per page.
+        cached_page (dict): The previously cached page, if any.
+
+    Returns:
+        tuple: The page as a dict of its ETag, last page number, asset names, package index asset URLs and split
+        subtree asset names, and whether it changed since it was cached.
     """
-    Retrieves the released versions of the Arduino Boards from the GitHub API.
+    headers = github_headers()
+    if cached_page and cached_page.get('etag'):
+        headers['If-None-Match'] = cached_page['etag']
+
+    async with session.get(f'{API_URL}/releases', params={'per_page': str(per_page), 'page': str(page)}, headers=headers) as req:
+        if req.status == 304:
+            return cached_page, False
+        req.raise_for_status()
+        releases = await req.json()
+        last_link = req.links.get('last')
+        last_page = int(last_link['url'].query.get('page', page)) if last_link else page
+        return {
+            'etag': req.headers.get('ETag'),
+            'last_page': max(last_page, page),
+            'assets': [asset['name'] for release in releases for asset in release['assets']],
+            'package_indexes': [asset['url'] for release in releases for asset in release['assets'] if asset['name'] == PACKAGE_INDEX_NAME],
+            'tool_assets': [asset['name'] for release in releases for asset in release['assets'] if TOOL_ASSET_PATTERN.match(asset['name'])],
+        }, True
+
+@tracer.traced()
+async def get_release_pages(session: aiohttp.ClientSession, per_page=100, cache_dir=RELEASE_CACHE_DIR):
+    """
+    Retrieves the asset listing of every published release from the GitHub API.
+
+    The first page is requested on its own and the remaining pages named by its Link header are fetched concurrently.
+    Pages are cached in cache_dir and revalidated with If-None-Match. New releases always appear on the first page,
+    so when it is unchanged the cached pages are used as they are and the whole lookup costs a single 304 response.
 
     Args:
-        per_page (int): The number of releases to retrieve per page. Defaults to 30.
+        per_page (int): The number of releases to retrieve per page. Defaults to 100, the API maximum.
+        cache_dir (str): The directory of the release list cache, or None to disable caching. Defaults to RELEASE_CACHE_DIR.
+
+    Returns:
+        list: The pages in order, newest releases first, as returned by fetch_release_page.
+    """
+    cache_file = path.join(cache_dir, 'releases.json') if cache_dir else None
+    cache = load_json_cache(cache_file)
+    cache_key = f"{API_URL}/releases?per_page={per_page}&format={RELEASE_CACHE_FORMAT}"
+    cached_pages = cache.get(cache_key, {})
+
+    first_page, changed = await fetch_release_page(session, 1, per_page, cached_pages.get('1'))
+    if changed:
+        remaining_pages = range(2, first_page['last_page'] + 1)
+        results = await asyncio.gather(*(fetch_release_page(session, page, per_page, cached_pages.get(str(page))) for page in remaining_pages))
+        cached_pages = {'1': first_page, **{str(page): result for page, (result, _) in zip(remaining_pages, results)}}
+        if cache_file:
+            cache = {cache_key: cached_pages}
+            write_atomic(cache_file, json.dumps(cache).encode())
+    else:
+        print("Release list unchanged since last run")
+    return [cached_pages[page] for page in sorted(cached_pages, key=int)]
+
+def parse_released_versions(pages: List[dict]):
+    """
+    Finds the newest released version of each platform in the release pages.
 
     Returns:
         dict: A dictionary containing the released versions of the Arduino Boards, indexed by platform.
     """
     released_versions = {}
-    page_number = 0
-    while True:
-        async with session.get('https://api.github.com/repos/AaronLi/Arduino-Boards/releases', headers={'accept': 'application/vnd.github+json', 'per_page': str(per_page), 'page':str(page_number), "X-Github-Api-Version": '2022-11-28'}) as req:
-            releases = await req.json()
-            for release in releases:
-                for asset in release['assets']:
-                    if asset['name'].startswith('manifest'):
-                        continue
-                    version, hash_platform_file = asset['name'].split('_', 1)
-                    hash, platform_file = hash_platform_file.split('_', 1)
-                    platform, extension = platform_file.split('.', 1)
-                    print(f"Version {version} for {platform} filetype {extension} with sha256 {hash}")
-                    version = list(map(int, version.split('.')))
-                    if platform not in released_versions or version_ordering(version, released_versions[platform]) > 0:
-                        released_versions[platform] = version
-
-            if len(releases) < per_page:
-                break
-            page_number += 1
+    for page in pages:
+        for asset_name in page['assets']:
+            if asset_name.startswith('manifest') or asset_name == PACKAGE_INDEX_NAME or TOOL_ASSET_PATTERN.match(asset_name):
+                continue
+            parsed = parse_asset_name(asset_name)
+            if parsed is None:
+                print(f"Ignoring unrecognized release asset {asset_name}")
+                continue
+            version, sha256, platform, extension = parsed
+            print(f"Version {'.'.join(map(str, version))} for {platform} filetype {extension} with sha256 {sha256}")
+            if platform not in released_versions or version_ordering(version, released_versions[platform]) > 0:
+                released_versions[platform] = version
     return released_versions
 
+def find_package_index_asset(pages: List[dict]):
+    """
+    Returns the API URL of the package index attached to the newest release that has one, or None.
+    """
+    for page in pages:
+        if page['package_indexes']:
+            return page['package_indexes'][0]
+    return None
+
+def find_published_tools(pages: List[dict]):
+    """
+    Returns the names of the split subtree assets already attached to a release.
+    """
+    return {name for page in pages for name in page['tool_assets']}
+
+@tracer.traced()
+async def load_previous_package_index(session: aiohttp.ClientSession, pages: List[dict], cache_dir=RELEASE_CACHE_DIR):
+    """
+    Loads the package index of the newest release, so new platform versions can be appended to it.
+
+    Release assets never change, so a local copy remembered with the URL it came from is reused without downloading.
+
+    Returns:
+        dict: The previous package index, or a new empty one if no release has an index yet.
+    """
+    asset_url = find_package_index_asset(pages)
+    if asset_url is None:
+        print("No previous package index found, starting a new one")
+        return new_package_index()
+
+    cache_file = path.join(cache_dir, PACKAGE_INDEX_NAME) if cache_dir else None
+    cached = load_json_cache(cache_file)
+    if cached.get('source') == asset_url:
+        return cached['index']
+
+    async with session.get(asset_url, headers=github_headers(accept='application/octet-stream')) as req:
+        req.raise_for_status()
+        index = json.loads(await req.read())
+    if cache_file:
+        write_atomic(cache_file, json.dumps({'source': asset_url, 'index': index}).encode())
+    return index
+
+@tracer.traced()
 async def get_commited_versions():
     """
     Returns a dictionary containing the version numbers of each board in the 'platforms' directory that has a 'platform.txt' file.
     The dictionary keys are the board names and the values are lists of integers representing the version numbers.
     """
     commit_versions = {}
-
-    for platform in await aiofiles.os.listdir('platforms'):
-        config_file = path.join('platforms', platform, 'platform.txt')
-        if not await aiofiles.os.path.exists(config_file):
-            continue
-    
-        async with aiofiles.open(config_file) as f:
-            async for line in f:
-                if line.startswith('version'):
-                    version = line.split('=', 1)[1].strip()
-                    commit_versions[platform] = list(map(int, version.split('.')))
-                    break
+    for platform, files in (await asyncio.to_thread(load_platforms, 'platforms')).items():
+        version = files['platform'].get('version')
+        # malformed versions are reported by validate_release
+        if version is not None and VERSION_PATTERN.match(version):
+            commit_versions[platform] = list(map(int, version.split('.')))
     return commit_versions
 
+@tracer.traced()
+async def validate_release(released_versions: Dict[str, List[int]]):
+    """
+    Checks every platform before anything is archived and stops the release with all the problems found.
+
+    See validate_platforms.validate_platforms for the checks.
+    """
+    errors = await asyncio.to_thread(validate_platforms, 'platforms', released_versions)
+    if errors:
+        for error in errors:
+            print(error)
+        raise SystemExit(f"{len(errors)} problem(s) found in the platforms, nothing was archived or uploaded")
+
 def get_updated_platforms(released_versions, commited_versions):
     """
     Returns a dictionary of boards and their updated versions based on the input of released and committed versions.
@@ -106,37 +256,140 @@ def get_updated_platforms(released_versions, commited_versions):
                     raise ValueError("Board {} has older version than release: {} < {}".format(platform, version, released_versions[platform]))
     return updated
 
-async def create_platform_archives(work_dir, updated_platforms):
+def archive_platform(work_dir: str, platform: str, version: List[int], cache_dir: str = None, codec: str = ARCHIVE_CODEC, split: Tuple[str, ...] = ()):
+    """
+    Creates the compressed archive for a single platform. Runs inside a worker process.
+
+    Archives are reproducible and cached by the hash of the platform tree, see platform_archive.build_platform_archive.
+    The checksum and size are computed while the archive is written, without reading the file back.
+
+    Args:
+        work_dir (str): The path to the working directory.
+        platform (str): The name of the platform directory under 'platforms'.
+        version (list): The new version number of the platform.
+        cache_dir (str): The archive cache directory, or None to always rebuild.
+        codec (str): The archive format, a key of platform_archive.ARCHIVE_CODECS. Defaults to ARCHIVE_CODEC.
+        split (tuple): Top level directories published separately by archive_subtree and left out of this archive.
+
+    Returns:
+        dict: The path to the newly created archive, its version number, filename, SHA-256 checksum and size in bytes,
+        plus the timings of each step and the worker pid for record_archive_trace.
+    """
+    version_str = '.'.join(map(str, version))
+    print(f"Board {platform} has new version {version_str}")
+
+    extension = ARCHIVE_CODECS[codec]['extension']
+    compressed_file_path = path.join(work_dir, f"{platform}.{extension}")
+    archive = build_platform_archive(path.join('platforms', platform), platform, compressed_file_path, cache_dir, codec, split=split)
+    if archive['cached']:
+        print(f"Reusing cached archive for {platform} (tree {archive['tree_hash'][:12]})")
+    sha256 = archive['sha256']
+
+    # rename file to {version}_{sha256}_{platform}.{extension}
+    final_file_path = f"{version_str}_{sha256}_{platform}.{extension}"
+    new_file_path = path.join(work_dir, final_file_path)
+    os.rename(compressed_file_path, new_file_path)
+
+    return {"local_path": new_file_path, "version": version_str, "filename": final_file_path, "sha256": sha256, "size": archive['size'],
+            "cached": archive['cached'], "timings": archive['timings'], "pid": os.getpid()}
+
+def archive_subtree(work_dir: str, platform: str, subtree: str, tool: str, published: Set[str], cache_dir: str = None, codec: str = ARCHIVE_CODEC):
     """
-    Create compressed archives for updated boards.
+    Creates the archive of a platform subtree published as a separate tool. Runs inside a worker process.
+
+    The asset is named after the hash of the subtree, so an unchanged subtree maps to an asset that is already attached
+    to an earlier release. In that case nothing is compressed or uploaded and the platform keeps depending on it.
 
     Args:
         work_dir (str): The path to the working directory.
-        updated_boards (dict): A dictionary containing the names of the updated boards as keys and their new version numbers as values.
+        platform (str): The name of the platform directory under 'platforms'.
+        subtree (str): The top level directory of the platform to archive.
+        tool (str): The tool name the subtree is published as.
+        published (set): The names of the subtree assets already on a release, see find_published_tools.
+        cache_dir (str): The archive cache directory, or None to always rebuild.
+        codec (str): The archive format, a key of platform_archive.ARCHIVE_CODECS. Defaults to ARCHIVE_CODEC.
 
     Returns:
-        dict: A dictionary containing the paths to the newly created archives, their version numbers, and the names of the boards they correspond to.
+        dict: The tool name, its version and asset filename, and whether the asset is already published. Unpublished
+        subtrees also have the same archive fields as archive_platform.
     """
-    new_archives = {}
-    for platform, version in updated_platforms.items():
-        version_str = '.'.join(map(str, version))
-        print(f"Board {platform} has new version {version_str}")
-
-        compressed_file_path = path.join(work_dir, f"{platform}.tar.bz2")
-        with tarfile.open(compressed_file_path, "w:bz2") as tar:
-            
-            tar.add(path.join('platforms', platform), arcname=platform)
-
-        async with aiofiles.open(compressed_file_path, 'rb') as f:
-            sha256 = hashlib.sha256(await f.read()).hexdigest()
-        
-        # rename file to {version}_{sha256}_{platform}.tar.bz2
-        final_file_path = f"{version_str}_{sha256}_{platform}.tar.bz2"
-        new_file_path = path.join(work_dir, final_file_path)
-        await aiofiles.os.rename(compressed_file_path, new_file_path)
-
-        new_archives[platform] = {"local_path": new_file_path, "version": version_str, "filename": final_file_path}
-    return new_archives
+    directory = path.join('platforms', platform, subtree)
+    start = time.time()
+    digests = DigestCache(path.join(cache_dir, 'digests', f"{tool}.json") if cache_dir else None)
+    tree_hash, _ = hash_tree(directory, digests)
+    digests.save()
+    version = tree_hash[:TREE_HASH_LENGTH]
+    extension = ARCHIVE_CODECS[codec]['extension']
+    filename = f"{tool}_{version}.{extension}"
+    if filename in published:
+        print(f"Subtree {subtree} of {platform} is unchanged, reusing {filename}")
+        return {"tool": tool, "version": version, "filename": filename, "published": True, "size": 0, "cached": True,
+                "timings": {'hash_tree': (start, time.time())}, "pid": os.getpid()}
+
+    local_path = path.join(work_dir, filename)
+    archive = build_platform_archive(directory, tool, local_path, cache_dir, codec)
+    return {"tool": tool, "version": version, "filename": filename, "published": False, "local_path": local_path,
+            "sha256": archive['sha256'], "size": archive['size'], "cached": archive['cached'], "timings": archive['timings'], "pid": os.getpid()}
+
+def record_archive_trace(platform: str, archive: Dict[str, Union[str, int]]):
+    """
+    Adds the spans a worker process measured while archiving a platform to the trace, and removes them from the result.
+    """
+    for step, (start, end) in archive.pop('timings', {}).items():
+        tracer.record(f"{step} {platform}", start, end, category=step, pid=archive['pid'], tid=0, cached=archive['cached'])
+    tracer.count('bytes_archived', archive['size'])
+    tracer.count('archives_cached', int(archive['cached']))
+
+def get_archive_workers(updated_platforms, max_workers=None):
+    """
+    Returns the number of archiving processes to use, one per archive job unless limited.
+
+    Args:
+        updated_platforms (dict): The platforms, or archive jobs, that will be archived.
+        max_workers (int): Upper bound on the number of processes. Defaults to the ARCHIVE_WORKERS
+            environment variable, or the CPU count if that is unset.
+
+    Returns:
+        int: The number of worker processes.
+    """
+    if max_workers is None:
+        max_workers = int(os.environ.get('ARCHIVE_WORKERS', 0)) or os.cpu_count() or 1
+    return max(1, min(len(updated_platforms), max_workers))
+
+def submit_platform_archives(pool: Executor, work_dir, updated_platforms, cache_dir=RELEASE_CACHE_DIR, split_packaging=None) -> Dict[str, asyncio.Future]:
+    """
+    Schedules an archive job for each updated platform on the given executor.
+
+    Args:
+        pool (Executor): The executor the archive jobs run on.
+        work_dir (str): The path to the working directory.
+        updated_platforms (dict): A dictionary containing the names of the updated platforms as keys and their new version numbers as values.
+        cache_dir (str): The archive cache directory. Defaults to RELEASE_CACHE_DIR.
+        split_packaging (dict): The split subtrees of each platform, see load_split_packaging.
+
+    Returns:
+        dict: A dictionary of platform names to awaitables resolving to the result of archive_platform.
+    """
+    loop = asyncio.get_running_loop()
+    split_packaging = split_packaging or {}
+    return {
+        platform: loop.run_in_executor(pool, archive_platform, work_dir, platform, version, cache_dir, ARCHIVE_CODEC, tuple(split_packaging.get(platform, {})))
+        for platform, version in updated_platforms.items()
+    }
+
+def submit_subtree_archives(pool: Executor, work_dir, split_packaging, published: Set[str], cache_dir=RELEASE_CACHE_DIR) -> Dict[str, asyncio.Future]:
+    """
+    Schedules an archive_subtree job for each split subtree of the updated platforms.
+
+    Returns:
+        dict: A dictionary of tool names to awaitables resolving to the result of archive_subtree.
+    """
+    loop = asyncio.get_running_loop()
+    return {
+        tool: loop.run_in_executor(pool, archive_subtree, work_dir, platform, subtree, tool, published, cache_dir)
+        for platform, subtrees in split_packaging.items()
+        for subtree, tool in subtrees.items()
+    }
 
 def create_tag_name(updated_platforms: Dict[str, Dict[str, Union[str, int]]]):
     """
@@ -164,6 +417,7 @@ def create_release_body(updated_platforms: Dict[str, Dict[str, Union[str, int]]]
                                       
     return "New versions have been released for the following boards:\n" + '\n'.join(version_change_strings)
 
+@tracer.traced()
 async def create_release(session: aiohttp.ClientSession, auth_token: str, updated_platforms: Dict[str, Dict[str, Union[str, int]]], released_platforms: Dict[str, List[int]]):
     release_body = {
                 "tag_name": create_tag_name(updated_platforms),
@@ -171,49 +425,177 @@ async def create_release(session: aiohttp.ClientSession, auth_token: str, update
                 "name": create_release_title(updated_platforms),
                 "body": create_release_body(updated_platforms, released_versions=released_platforms),
             }
-    async with session.post(
-        'https://api.github.com/repos/AaronLi/Arduino-Boards/releases',
-          headers={
-              "accept": "application/vnd.github+json",
-               'Authorization': f'Bearer {auth_token}',
-               "X-Github-Api-Version": '2022-11-28'
-            },
-            data=json.dumps(release_body)) as req:
+    # reuse the draft left behind by an interrupted run so its uploaded assets are not sent again
+    async with session.get(f'{API_URL}/releases', params={'per_page': '100'}, headers=github_headers(auth_token)) as req:
+        for release in await req.json():
+            if release.get('draft') and release.get('tag_name') == release_body['tag_name']:
+                print(f"Resuming draft release {release['id']}")
+                return release['id']
+
+    async with session.post(f'{API_URL}/releases', headers=github_headers(auth_token), data=json.dumps(release_body)) as req:
         json_response = await req.json()
         print(json_response)
         return json_response['id']
 
-async def upload_assets(session: aiohttp.ClientSession, auth_token: str, release_id: str, updated_platforms: Dict[str, Dict[str, Union[str, int]]]):
-    for board, info in updated_platforms.items():
-        async with aiofiles.open(info['local_path'], 'rb') as f:
-            async with session.post(
-                f'https://uploads.github.com/repos/AaronLi/Arduino-Boards/releases/{release_id}/assets?name={updated_platforms[board]["filename"]}',
-                headers={
-                    "accept": "application/vnd.github+json",
-                    'Authorization': f'Bearer {auth_token}',
-                    "X-Github-Api-Version": '2022-11-28',
-                    'Content-Type': 'application/octet-stream'
-                },
-                data=await f.read()) as req:
-                response_json = await req.json()
-                print(response_json['name'], response_json['state'])
-
-async def upload_manifest(session: aiohttp.ClientSession, auth_token: str, release_id: str, released_platforms, updated_platforms):
+def create_session(max_connections=MAX_CONNECTIONS):
+    """
+    Creates the client session shared by every GitHub request, with a connection pool sized for concurrent uploads.
+
+    Args:
+        max_connections (int): The maximum number of simultaneous connections. Defaults to MAX_CONNECTIONS.
+
+    Returns:
+        aiohttp.ClientSession: The new session.
+    """
+    connector = aiohttp.TCPConnector(limit=max_connections, limit_per_host=max_connections, ttl_dns_cache=300, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+def github_headers(auth_token: str = None, accept: str = "application/vnd.github+json", **extra_headers):
+    """
+    Returns the headers sent with every GitHub API request.
+
+    Args:
+        auth_token (str): The API token, if the request is authenticated.
+        accept (str): The accepted media type. Defaults to the GitHub JSON media type.
+        extra_headers: Additional headers to include.
+
+    Returns:
+        dict: The request headers.
+    """
+    headers = {"accept": accept, "X-Github-Api-Version": '2022-11-28'}
+    if auth_token:
+        headers['Authorization'] = f'Bearer {auth_token}'
+    headers.update(extra_headers)
+    return headers
+
+async def file_chunks(file_path: str, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Yields the contents of a file in chunks so it can be streamed as a request body.
+
+    Args:
+        file_path (str): The file to read.
+        chunk_size (int): The number of bytes per chunk. Defaults to UPLOAD_CHUNK_SIZE.
+    """
+    async with aiofiles.open(file_path, 'rb') as f:
+        while chunk := await f.read(chunk_size):
+            tracer.count('bytes_uploaded', len(chunk))
+            yield chunk
+
+async def get_release_assets(session: aiohttp.ClientSession, auth_token: str, release_id: str):
+    """
+    Retrieves the assets already attached to a release.
+
+    Returns:
+        dict: A dictionary of asset names to the asset objects returned by the API.
+    """
+    async with session.get(f'{API_URL}/releases/{release_id}/assets', params={'per_page': '100'}, headers=github_headers(auth_token)) as req:
+        req.raise_for_status()
+        return {asset['name']: asset for asset in await req.json()}
+
+async def delete_incomplete_asset(session: aiohttp.ClientSession, auth_token: str, release_id: str, name: str):
+    """
+    Deletes the incomplete asset a failed upload may have left on the release, which would make GitHub reject the
+    next upload of the same name as already_exists.
+
+    Returns:
+        dict: The asset of that name if it was fully uploaded after all, otherwise None.
+    """
+    asset = (await get_release_assets(session, auth_token, release_id)).get(name)
+    if asset is None or asset['state'] == 'uploaded':
+        return asset
+    async with session.delete(f"{API_URL}/releases/assets/{asset['id']}", headers=github_headers(auth_token)) as req:
+        req.raise_for_status()
+    return None
+
+async def upload_asset(session: aiohttp.ClientSession, auth_token: str, release_id: str, name: str, file_path: str = None, data: bytes = None, retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF):
+    """
+    Uploads a single release asset, retrying with exponential backoff on connection errors and retryable statuses.
+
+    Exactly one of file_path or data must be given. Files are streamed in chunks rather than read into memory.
+    Before each retry the asset left behind by the failed attempt is deleted, unless GitHub finished it, in which
+    case it is returned without uploading again.
+
+    Args:
+        name (str): The asset name.
+        file_path (str): The path of the file to upload.
+        data (bytes): The in-memory contents to upload.
+        retries (int): The number of retries after the first attempt. Defaults to UPLOAD_RETRIES.
+        backoff (float): The delay before the first retry in seconds, doubled after each attempt. Defaults to UPLOAD_BACKOFF.
+
+    Returns:
+        dict: The asset object returned by the API.
+    """
+    size = len(data) if file_path is None else (await aiofiles.os.stat(file_path)).st_size
+    headers = github_headers(auth_token, **{'Content-Type': 'application/octet-stream', 'Content-Length': str(size)})
+    with tracer.span(f"upload {name}", category='upload', size=size) as span:
+        for attempt in range(retries + 1):
+            span['attempts'] = attempt + 1
+            try:
+                if attempt > 0:
+                    uploaded = await delete_incomplete_asset(session, auth_token, release_id, name)
+                    if uploaded is not None and uploaded['size'] == size:
+                        return uploaded
+                body = data if file_path is None else file_chunks(file_path)
+                if file_path is None:
+                    tracer.count('bytes_uploaded', size)
+                async with session.post(f'{UPLOADS_URL}/releases/{release_id}/assets', params={'name': name}, headers=headers, data=body) as req:
+                    if req.status in RETRY_STATUSES:
+                        raise aiohttp.ClientResponseError(req.request_info, req.history, status=req.status, message=req.reason)
+                    req.raise_for_status()
+                    return await req.json()
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError, aiohttp.ClientResponseError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES or attempt == retries:
+                    raise
+                delay = backoff * 2 ** attempt
+                tracer.count('http_retries')
+                print(f"Upload of {name} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+async def upload_archive(session: aiohttp.ClientSession, auth_token: str, release_id: str, info: Dict[str, Union[str, int]], existing_assets: Dict[str, dict], semaphore: asyncio.Semaphore):
+    """
+    Uploads one release asset unless an identical asset is already there.
+
+    Content addressed archives (see is_content_addressed) that are already fully uploaded with the same size are
+    skipped, so a re-run only sends what is missing. Other existing assets, and incomplete assets left behind by an
+    interrupted run, are deleted and uploaded again.
+
+    Args:
+        info (dict): The archive, as returned by archive_platform, or any asset given by its 'filename', 'size' and
+            either the 'local_path' of its file or its in-memory 'data'.
+        existing_assets (dict): The assets already on the release, as returned by get_release_assets.
+        semaphore (asyncio.Semaphore): Limits the number of uploads in flight.
+    """
+    existing = existing_assets.get(info['filename'])
+    if existing is not None:
+        if is_content_addressed(info['filename']) and existing['state'] == 'uploaded' and existing['size'] == info['size']:
+            print(existing['name'], 'already uploaded')
+            return
+        async with session.delete(f"{API_URL}/releases/assets/{existing['id']}", headers=github_headers(auth_token)) as req:
+            req.raise_for_status()
+    async with semaphore:
+        response_json = await upload_asset(session, auth_token, release_id, info['filename'], file_path=info.get('local_path'), data=info.get('data'))
+    print(response_json['name'], response_json['state'])
+
+@tracer.traced()
+async def build_manifest(released_platforms, updated_platforms):
+    """
+    Builds the manifest entries of every released and updated platform from their boards.txt and architecture.txt.
+
+    Returns:
+        tuple: The manifest, indexed by platform, and the platform.txt name of each updated platform.
+        Archive details are added to the manifest later with add_archive_to_manifest.
+    """
     combined_platforms = {**released_platforms, **updated_platforms}
     manifest = {}
+    platform_metadata = {}
+    loaded_platforms = await asyncio.to_thread(load_platforms, 'platforms')
     for platform in combined_platforms:
         platform_directory = path.join('platforms', platform)
-        platform_boards = path.join(platform_directory, 'boards.txt')
         variants_directory = path.join(platform_directory, 'variants')
-        boards = set(path.basename(path.normpath(board)) for board in await aiofiles.os.listdir(variants_directory))
-        board_names = []
-        async with aiofiles.open(platform_boards) as f:
-            async for line in f:
-                if 'name' in line:
-                    board_id, line_name = line.split('=', 1)
-                    board_name = line_name.strip()
-                    if board_id.split('.')[0] in boards:
-                        board_names.append(board_name)
+        variants = set(await aiofiles.os.listdir(variants_directory))
+        boards = loaded_platforms[platform]['boards']
+        board_names = [boards[f'{board_id}.name'] for board_id in boards.boards if boards.get(f'{board_id}.build.variant', board_id) in variants]
 
         async with aiofiles.open(path.join(platform_directory, 'architecture.txt')) as f:
             architecture = (await f.read()).strip()
@@ -222,24 +604,179 @@ async def upload_manifest(session: aiohttp.ClientSession, auth_token: str, relea
             'architecture': architecture,
             'version': '.'.join(map(str, combined_platforms[platform]))
         }
-    async with session.post(
-                f'https://uploads.github.com/repos/AaronLi/Arduino-Boards/releases/{release_id}/assets?name=manifest.json',
-                headers={
-                    "accept": "application/vnd.github+json",
-                    'Authorization': f'Bearer {auth_token}',
-                    "X-Github-Api-Version": '2022-11-28',
-                    'Content-Type': 'application/octet-stream'
-                },
-                data=json.dumps(manifest)) as req:
-        response = await req.json()
-        print(response['name'], response['state'])
+        if platform in updated_platforms:
+            platform_metadata[platform] = {'name': loaded_platforms[platform]['platform'].get('name', platform)}
+    return manifest, platform_metadata
+
+def add_archive_to_manifest(manifest, platform: str, archive: Dict[str, Union[str, int]]):
+    """
+    Adds the filename, checksum and size of a newly created archive to its platform's manifest entry.
+    """
+    manifest[platform]['archiveFileName'] = archive['filename']
+    manifest[platform]['checksum'] = f"SHA-256:{archive['sha256']}"
+    manifest[platform]['size'] = str(archive['size'])
+
+@tracer.traced()
+async def upload_manifest(session: aiohttp.ClientSession, auth_token: str, release_id: str, manifest, existing_assets: Dict[str, dict]):
+    """
+    Uploads the manifest, replacing the one a resumed release already has. See upload_archive.
+    """
+    data = json.dumps(manifest).encode()
+    await upload_archive(session, auth_token, release_id, {'filename': 'manifest.json', 'data': data, 'size': len(data)}, existing_assets, asyncio.Semaphore(1))
+
+@tracer.traced()
+async def update_package_index(work_dir: str, index, tag_name: str, manifest, platform_metadata, new_archives, split_packaging=None, subtree_archives=None):
+    """
+    Appends the newly archived platform versions to the package index and writes it to work_dir atomically.
+
+    Only the new entries are built; the entries of earlier releases are kept exactly as they were. Split subtrees are
+    listed as tools, and each platform depends on the current version of its own subtrees.
+
+    Args:
+        split_packaging (dict): The split subtrees of each platform, see load_split_packaging.
+        subtree_archives (dict): The results of archive_subtree, indexed by tool name.
+
+    Returns:
+        str: The path of the written package index.
+    """
+    split_packaging = split_packaging or {}
+    subtree_archives = subtree_archives or {}
+    tools = []
+    for tool, archive in subtree_archives.items():
+        if archive['published']:
+            if not has_tool(index, tool, archive['version']):
+                print(f"Warning: {archive['filename']} is published but missing from the previous package index")
+            continue
+        tools.append(tool_entry(tool, archive['version'], f"{DOWNLOAD_URL}/{tag_name}/{archive['filename']}", archive))
+    if tools:
+        print(f"Added {add_tools(index, tools)} tool version(s) to the package index")
+
+    entries = []
+    for platform, archive in new_archives.items():
+        tools_dependencies = await asyncio.to_thread(load_tools_dependencies, path.join('platforms', platform))
+        for tool in split_packaging.get(platform, {}).values():
+            tools_dependencies.append({'packager': index['packages'][0]['name'], 'name': tool, 'version': subtree_archives[tool]['version']})
+        entries.append(platform_entry(
+            name=platform_metadata[platform]['name'],
+            architecture=manifest[platform]['architecture'],
+            version=archive['version'],
+            url=f"{DOWNLOAD_URL}/{tag_name}/{archive['filename']}",
+            archive=archive,
+            boards=manifest[platform]['boards'],
+            tools_dependencies=tools_dependencies,
+        ))
+    print(f"Added {add_platforms(index, entries)} platform version(s) to the package index")
+
+    index_path = path.join(work_dir, PACKAGE_INDEX_NAME)
+    await asyncio.to_thread(write_package_index, index, index_path)
+    return index_path
+
+@tracer.traced()
+async def release_pipeline(session: aiohttp.ClientSession, auth_token: str, work_dir: str, updated_platforms: Dict[str, List[int]], released_versions: Dict[str, List[int]], release_pages: List[dict] = (), max_workers=None, max_concurrent=MAX_CONCURRENT_UPLOADS):
+    """
+    Archives, releases and uploads the updated platforms with every stage overlapped.
+
+    Archive jobs are submitted to the process pool first. The release is created and the manifest is built while they
+    compress. Each archive is put on a queue as soon as it finishes, and the consumer starts its upload right away,
+    so the total time approaches the longer of compression and upload rather than their sum. Subtrees a platform
+    publishes separately (see load_split_packaging) are archived as their own jobs and only uploaded when their
+    hash has no asset yet. Once every archive is known, the manifest and the updated package index are uploaded.
+
+    Args:
+        work_dir (str): The directory the archives are written to.
+        updated_platforms (dict): The new version of each updated platform.
+        released_versions (dict): The latest released version of each platform.
+        release_pages (list): The release pages from get_release_pages, used to find the previous package index.
+        max_workers (int): The maximum number of archiving processes. See get_archive_workers.
+        max_concurrent (int): The maximum number of uploads in flight. Defaults to MAX_CONCURRENT_UPLOADS.
+
+    Returns:
+        dict: The archives that were created, indexed by platform.
+    """
+    release_platforms = {platform: {'version': '.'.join(map(str, version))} for platform, version in updated_platforms.items()}
+    split_packaging = {platform: load_split_packaging(path.join('platforms', platform)) for platform in updated_platforms}
+    new_archives = {}
+    subtree_archives = {}
+    queue = asyncio.Queue()
+
+    jobs = [*updated_platforms, *(tool for subtrees in split_packaging.values() for tool in subtrees.values())]
+
+    with ProcessPoolExecutor(max_workers=get_archive_workers(jobs, max_workers)) as pool:
+        pending = submit_platform_archives(pool, work_dir, updated_platforms, split_packaging=split_packaging)
+        pending_subtrees = submit_subtree_archives(pool, work_dir, split_packaging, find_published_tools(release_pages))
+        manifest_task = asyncio.create_task(build_manifest(released_versions, updated_platforms))
+        index_task = asyncio.create_task(load_previous_package_index(session, list(release_pages)))
+
+        async def produce(platform, future):
+            archive = await future
+            record_archive_trace(platform, archive)
+            new_archives[platform] = archive
+            await queue.put(archive)
+
+        async def produce_subtree(tool, future):
+            archive = await future
+            record_archive_trace(tool, archive)
+            subtree_archives[tool] = archive
+            if archive['published']:
+                tracer.count('subtrees_reused')
+            else:
+                await queue.put(archive)
+
+        async def produce_all():
+            try:
+                await asyncio.gather(*(produce(platform, future) for platform, future in pending.items()),
+                                     *(produce_subtree(tool, future) for tool, future in pending_subtrees.items()))
+            finally:
+                await queue.put(None)
+
+        async def consume(release_id):
+            existing_assets = await get_release_assets(session, auth_token, release_id)
+            semaphore = asyncio.Semaphore(max_concurrent)
+            uploads = []
+            while (archive := await queue.get()) is not None:
+                uploads.append(asyncio.create_task(upload_archive(session, auth_token, release_id, archive, existing_assets, semaphore)))
+            await asyncio.gather(*uploads)
+            return existing_assets
+
+        producer = asyncio.create_task(produce_all())
+        try:
+            release_id = await create_release(session, auth_token, release_platforms, released_versions)
+            _, existing_assets = await asyncio.gather(producer, consume(release_id))
+        except BaseException:
+            producer.cancel()
+            manifest_task.cancel()
+            index_task.cancel()
+            raise
+
+    manifest, platform_metadata = await manifest_task
+    for platform, archive in new_archives.items():
+        add_archive_to_manifest(manifest, platform, archive)
+    index_path = await update_package_index(work_dir, await index_task, create_tag_name(release_platforms), manifest, platform_metadata,
+                                            new_archives, split_packaging, subtree_archives)
+    index_info = {'filename': PACKAGE_INDEX_NAME, 'local_path': index_path, 'size': os.path.getsize(index_path)}
+    await asyncio.gather(
+        upload_manifest(session, auth_token, release_id, manifest, existing_assets),
+        upload_archive(session, auth_token, release_id, index_info, existing_assets, asyncio.Semaphore(1)),
+    )
+    return new_archives
 
 
 async def main():
-    async with aiohttp.ClientSession() as session:
-        released_versions, commit_versions = await asyncio.gather(get_released_versions(session), get_commited_versions())
+    try:
+        await run_release()
+    finally:
+        print(tracer.summary())
+        if TRACE_FILE:
+            tracer.write_chrome_trace(TRACE_FILE)
+            print(f"Trace written to {TRACE_FILE}")
+
+async def run_release():
+    async with create_session() as session:
+        release_pages, commit_versions = await asyncio.gather(get_release_pages(session), get_commited_versions())
+        released_versions = parse_released_versions(release_pages)
         print('Versions in release:', released_versions)
         print('Versions in commit:', commit_versions)
+        await validate_release(released_versions)
 
         updated = get_updated_platforms(released_versions, commit_versions)
         print('Updated versions:', updated)
@@ -248,18 +785,10 @@ async def main():
             print("No updates found.")
             exit()
 
+        auth_token = os.environ['GH_API_TOKEN']
         async with aiofiles.tempfile.TemporaryDirectory() as tmpdir:
-            
-            new_archives = await create_platform_archives(tmpdir, updated)
-
+            new_archives = await release_pipeline(session, auth_token, tmpdir, updated, released_versions, release_pages)
             print(new_archives)
 
-            auth_token = os.environ['GH_API_TOKEN']
-            release_id = await create_release(session, auth_token, new_archives, released_versions)
-            await asyncio.gather(
-                upload_assets(session, auth_token, release_id, new_archives),
-                upload_manifest(session, auth_token, release_id, released_versions, updated)
-                )
-        
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+import os
+import json
+from typing import Dict, Iterable, List, Union
+from platform_archive import write_atomic
+
+PACKAGE_NAME = os.environ.get('PACKAGE_NAME', 'dumfing')
+PACKAGE_MAINTAINER = 'AaronLi'
+PACKAGE_WEBSITE = 'https://github.com/AaronLi/Arduino-Boards'
+# Split subtrees are platform independent, so every host the Boards Manager knows gets the same archive
+TOOL_HOSTS = ('i686-mingw32', 'x86_64-mingw32', 'x86_64-apple-darwin', 'arm64-apple-darwin', 'x86_64-pc-linux-gnu',
+              'i686-pc-linux-gnu', 'arm-linux-gnueabihf', 'aarch64-linux-gnu')
+
+def new_package_index():
+    """
+    Returns an empty Boards Manager package index with a single package for this repository.
+    """
+    return {
+        'packages': [
+            {
+                'name': PACKAGE_NAME,
+                'maintainer': PACKAGE_MAINTAINER,
+                'websiteURL': PACKAGE_WEBSITE,
+                'email': '',
+                'help': {'online': PACKAGE_WEBSITE},
+                'platforms': [],
+                'tools': [],
+            }
+        ]
+    }
+
+def platform_entry(name: str, architecture: str, version: str, url: str, archive: Dict[str, Union[str, int]], boards: List[str], tools_dependencies: List[dict]):
+    """
+    Creates the package index entry of one platform release.
+
+    Args:
+        name (str): The platform name shown in the Boards Manager, from platform.txt.
+        architecture (str): The platform architecture, from architecture.txt.
+        version (str): The platform version.
+        url (str): The download URL of the archive.
+        archive (dict): The archive, with the filename, sha256 and size returned by archive_platform.
+        boards (list): The names of the boards the platform provides.
+        tools_dependencies (list): The tools the platform needs, as packager/name/version dicts.
+    """
+    return {
+        'name': name,
+        'architecture': architecture,
+        'version': version,
+        'category': 'Contributed',
+        'url': url,
+        'archiveFileName': archive['filename'],
+        'checksum': f"SHA-256:{archive['sha256']}",
+        'size': str(archive['size']),
+        'help': {'online': PACKAGE_WEBSITE},
+        'boards': [{'name': board} for board in boards],
+        'toolsDependencies': tools_dependencies,
+    }
+
+def add_platforms(index, entries: Iterable[dict]):
+    """
+    Appends platform releases to a package index in place.
+
+    Existing entries are left untouched, so the cost only depends on the number of new entries.
+    An entry whose architecture and version are already listed is skipped.
+
+    Returns:
+        int: The number of entries added.
+    """
+    platforms = index['packages'][0]['platforms']
+    listed = {(platform['architecture'], platform['version']) for platform in platforms}
+    added = 0
+    for entry in entries:
+        key = (entry['architecture'], entry['version'])
+        if key not in listed:
+            platforms.append(entry)
+            listed.add(key)
+            added += 1
+    return added
+
+def tool_entry(name: str, version: str, url: str, archive: Dict[str, Union[str, int]]):
+    """
+    Creates the package index entry of a subtree published as a separate tool, see load_split_packaging.
+
+    Args:
+        name (str): The tool name.
+        version (str): The tool version, derived from the subtree hash.
+        url (str): The download URL of the archive.
+        archive (dict): The archive, with the filename, sha256 and size.
+    """
+    return {
+        'name': name,
+        'version': version,
+        'systems': [
+            {
+                'host': host,
+                'url': url,
+                'archiveFileName': archive['filename'],
+                'checksum': f"SHA-256:{archive['sha256']}",
+                'size': str(archive['size']),
+            }
+            for host in TOOL_HOSTS
+        ],
+    }
+
+def add_tools(index, entries: Iterable[dict]):
+    """
+    Appends tools to a package index in place, skipping any name and version that is already listed.
+
+    Returns:
+        int: The number of entries added.
+    """
+    tools = index['packages'][0]['tools']
+    listed = {(tool['name'], tool['version']) for tool in tools}
+    added = 0
+    for entry in entries:
+        key = (entry['name'], entry['version'])
+        if key not in listed:
+            tools.append(entry)
+            listed.add(key)
+            added += 1
+    return added
+
+def has_tool(index, name: str, version: str):
+    """
+    Returns whether a package index lists the given tool version.
+    """
+    return any(tool['name'] == name and tool['version'] == version for tool in index['packages'][0]['tools'])
+
+def load_split_packaging(platform_directory: str) -> Dict[str, str]:
+    """
+    Reads the subtrees a platform publishes as separate tools from extras/split_packaging.json.
+
+    The file maps top level directory names to tool names, e.g. {"drivers": "dumfing-samd-drivers"}. Each subtree is
+    left out of the platform archive and uploaded as its own content-addressed asset only when its contents change,
+    so the platform has to find it through the tool path rather than the platform path.
+
+    Returns:
+        dict: The tool name of each split subtree, or an empty dict if the platform is packaged whole.
+    """
+    file_path = os.path.join(platform_directory, 'extras', 'split_packaging.json')
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path) as f:
+        return json.load(f)
+
+def load_tools_dependencies(platform_directory: str):
+    """
+    Reads the tools a platform depends on from extras/tools_dependencies.json, which is not shipped in the archive.
+
+    Returns:
+        list: The packager/name/version dicts, or an empty list if the platform does not declare any.
+    """
+    file_path = os.path.join(platform_directory, 'extras', 'tools_dependencies.json')
+    if not os.path.exists(file_path):
+        print(f"Warning: {file_path} not found, the package index will not list tool dependencies")
+        return []
+    with open(file_path) as f:
+        return json.load(f)
+
+def write_package_index(index, file_path: str):
+    """
+    Writes a package index atomically, so readers never see a partially written file.
+    """
+    write_atomic(file_path, json.dumps(index, indent=2).encode())
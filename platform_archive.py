@@ -0,0 +1,259 @@
+import os
+import os.path as path
+import bz2
+import stat
+import gzip
+import json
+import shutil
+import tarfile
+import hashlib
+import zipfile
+import time
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Tuple, Union
+
+# The tree hashing lives with the platform tools, which also run from an installed platform, so a tree hashes the same
+# there as in the release archives
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), 'platforms', 'dumfing-samd', 'tools'))
+from file_digests import DigestCache, hash_tree, normalized_mode, write_atomic
+
+# Bump when the archive layout changes so stale cache entries are not reused
+ARCHIVE_FORMAT_VERSION = 2
+ARCHIVE_MTIME = int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+# zip timestamps cannot predate 1980
+ZIP_DATE_TIME = max((1980, 1, 1, 0, 0, 0), tuple(time.gmtime(ARCHIVE_MTIME)[:6]))
+
+# Archive formats accepted by the Boards Manager. Tar based codecs are compressed in independent
+# blocks on a thread pool; bz2 and gzip both allow concatenated streams so the result is still a
+# single valid file. The block size is fixed so the output does not depend on the worker count.
+ARCHIVE_CODECS = {
+    'bz2': {'extension': 'tar.bz2', 'compress': partial(bz2.compress, compresslevel=9), 'block_size': 900 * 1000},
+    'gz': {'extension': 'tar.gz', 'compress': partial(gzip.compress, compresslevel=9, mtime=ARCHIVE_MTIME), 'block_size': 1024 * 1024},
+    'zip': {'extension': 'zip'},
+}
+
+class HashingWriter:
+    """
+    File-like wrapper that computes the SHA-256 digest and byte count of everything written through it.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+class ParallelCompressor:
+    """
+    File-like writer that splits the byte stream into fixed size blocks, compresses the blocks on a thread
+    pool and writes them to the underlying file in order, in the style of pbzip2/pigz.
+
+    At most two blocks per worker are in flight, so memory use does not grow with the size of the input.
+    """
+    def __init__(self, fileobj, compress, block_size: int, workers: int = None):
+        self.fileobj = fileobj
+        self.compress = compress
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.blocks = 0
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        self.pending.append(self.pool.submit(self.compress, block))
+        self.blocks += 1
+        while len(self.pending) > self.workers * 2:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        # an empty input still needs one stream to be a valid compressed file
+        if self.buffer or not self.blocks:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.shutdown(cancel_futures=True)
+
+def write_deterministic_tar(fileobj, arcname: str, entries: List[Tuple[str, str, os.stat_result]], mode="w|"):
+    """
+    Streams a tar archive of the given entries with normalized metadata, so the same tree always produces the same bytes.
+
+    Entries must already be sorted. Timestamps are set to ARCHIVE_MTIME, ownership to root and permissions to normalized_mode.
+
+    Args:
+        fileobj: The file-like object the archive is written to.
+        arcname (str): The top level directory name inside the archive.
+        entries (list): The (relative path, full path, stat) entries returned by hash_tree.
+        mode (str): The tarfile mode, which selects the compression. Defaults to an uncompressed stream.
+    """
+    def make_info(name, file_stat):
+        info = tarfile.TarInfo(name)
+        info.mtime = ARCHIVE_MTIME
+        info.uid = info.gid = 0
+        info.uname = info.gname = ''
+        info.mode = normalized_mode(file_stat)
+        return info
+
+    with tarfile.open(fileobj=fileobj, mode=mode, format=tarfile.GNU_FORMAT) as tar:
+        root = tarfile.TarInfo(arcname)
+        root.type = tarfile.DIRTYPE
+        root.mtime = ARCHIVE_MTIME
+        root.mode = 0o755
+        tar.addfile(root)
+
+        for relative_path, full_path, file_stat in entries:
+            info = make_info(f"{arcname}/{relative_path}", file_stat)
+            if stat.S_ISDIR(file_stat.st_mode):
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            elif stat.S_ISLNK(file_stat.st_mode):
+                info.type = tarfile.SYMTYPE
+                info.linkname = os.readlink(full_path)
+                tar.addfile(info)
+            else:
+                info.size = file_stat.st_size
+                with open(full_path, 'rb') as f:
+                    tar.addfile(info, f)
+
+def write_deterministic_zip(fileobj, arcname: str, entries: List[Tuple[str, str, os.stat_result]]):
+    """
+    Streams a zip archive of the given entries with the same normalized metadata as write_deterministic_tar.
+
+    Members are deflated one after another; zip has no equivalent of concatenated streams to parallelize over.
+    """
+    def make_info(name, file_stat, file_type):
+        info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+        info.create_system = 3
+        info.external_attr = (file_type | normalized_mode(file_stat)) << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    with zipfile.ZipFile(fileobj, 'w', compresslevel=9) as archive:
+        for relative_path, full_path, file_stat in entries:
+            name = f"{arcname}/{relative_path}"
+            if stat.S_ISDIR(file_stat.st_mode):
+                info = make_info(name + '/', file_stat, stat.S_IFDIR)
+                info.external_attr |= 0x10
+                info.compress_type = zipfile.ZIP_STORED
+                archive.writestr(info, b'')
+            elif stat.S_ISLNK(file_stat.st_mode):
+                info = make_info(name, file_stat, stat.S_IFLNK)
+                info.external_attr = (stat.S_IFLNK | 0o777) << 16
+                archive.writestr(info, os.readlink(full_path))
+            else:
+                info = make_info(name, file_stat, stat.S_IFREG)
+                info.file_size = file_stat.st_size
+                with open(full_path, 'rb') as source, archive.open(info, 'w') as destination:
+                    shutil.copyfileobj(source, destination, 1024 * 1024)
+
+def write_archive(fileobj, arcname: str, entries: List[Tuple[str, str, os.stat_result]], codec: str = 'bz2', workers: int = None):
+    """
+    Writes a reproducible archive of the given entries in one of the ARCHIVE_CODECS formats.
+
+    Args:
+        fileobj: The file-like object the archive is written to.
+        arcname (str): The top level directory name inside the archive.
+        entries (list): The (relative path, full path, stat) entries returned by hash_tree.
+        codec (str): A key of ARCHIVE_CODECS. Defaults to 'bz2'.
+        workers (int): The number of compression threads. Defaults to the CPU count.
+    """
+    if codec not in ARCHIVE_CODECS:
+        raise ValueError(f"Unknown archive codec {codec}, expected one of {', '.join(ARCHIVE_CODECS)}")
+    if codec == 'zip':
+        write_deterministic_zip(fileobj, arcname, entries)
+        return
+
+    settings = ARCHIVE_CODECS[codec]
+    with ParallelCompressor(fileobj, settings['compress'], settings['block_size'], workers) as compressor:
+        write_deterministic_tar(compressor, arcname, entries)
+
+def link_or_copy(source: str, destination: str):
+    """
+    Hard links source to destination, copying instead when they are on different filesystems.
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def build_platform_archive(platform_directory: str, arcname: str, output_path: str, cache_dir: str = None, codec: str = 'bz2', workers: int = None, split: Tuple[str, ...] = ()) -> Dict[str, Union[str, int, bool]]:
+    """
+    Creates a reproducible archive of a platform directory, reusing a cached archive if the tree is unchanged.
+
+    Cached archives are stored under cache_dir keyed by the Merkle hash of the tree, the archive name, the codec and the
+    archive format. File digests are cached by stat data, so checking an unchanged tree only costs a directory walk.
+
+    Args:
+        platform_directory (str): The directory to archive.
+        arcname (str): The top level directory name inside the archive.
+        output_path (str): Where the archive is written.
+        cache_dir (str): The cache directory. Caching is disabled if None or empty.
+        codec (str): A key of ARCHIVE_CODECS. Defaults to 'bz2'.
+        workers (int): The number of compression threads. Defaults to the CPU count.
+        split (tuple): Top level directories packaged separately, left out of the archive.
+
+    Returns:
+        dict: The archive's SHA-256 digest, size in bytes, tree hash, whether it came from the cache and the
+        (start, end) wall clock times of the hash_tree and compress steps.
+    """
+    timings = {}
+    start = time.time()
+    digests = DigestCache(path.join(cache_dir, 'digests', f"{arcname}.json") if cache_dir else None)
+    tree_hash, entries = hash_tree(platform_directory, digests, split=split)
+    digests.save()
+    timings['hash_tree'] = (start, time.time())
+
+    key = hashlib.sha256(f"{ARCHIVE_FORMAT_VERSION}\0{ARCHIVE_MTIME}\0{codec}\0{arcname}\0{tree_hash}".encode()).hexdigest()
+    if cache_dir:
+        archives_dir = path.join(cache_dir, 'archives')
+        cached_archive = path.join(archives_dir, f"{key}.{ARCHIVE_CODECS[codec]['extension']}")
+        cached_metadata = path.join(archives_dir, f"{key}.json")
+        if path.exists(cached_archive) and path.exists(cached_metadata):
+            with open(cached_metadata) as f:
+                metadata = json.load(f)
+            link_or_copy(cached_archive, output_path)
+            return {**metadata, 'cached': True, 'timings': timings}
+
+    start = time.time()
+    with open(output_path, 'wb') as f:
+        writer = HashingWriter(f)
+        write_archive(writer, arcname, entries, codec, workers)
+    metadata = {'sha256': writer.hexdigest(), 'size': writer.size, 'tree_hash': tree_hash}
+    timings['compress'] = (start, time.time())
+
+    if cache_dir:
+        os.makedirs(archives_dir, exist_ok=True)
+        temp_archive = f"{cached_archive}.{os.getpid()}.tmp"
+        link_or_copy(output_path, temp_archive)
+        os.replace(temp_archive, cached_archive)
+        write_atomic(cached_metadata, json.dumps(metadata).encode())
+    return {**metadata, 'cached': False, 'timings': timings}
@@ -1,11 +1,18 @@
 @echo off
 set ARGS=/SE /SW /SA
+
+REM Releases ship the drivers as the dumfing-samd-drivers tool (see extras/split_packaging.json),
+REM installed next to the platform under packages\dumfing\tools. A git checkout has them in place.
+set DRIVERS=%cd%\drivers
+if not exist "%DRIVERS%" (
+  for /d %%d in ("..\..\..\tools\dumfing-samd-drivers\*") do set DRIVERS=%%~fd
+)
 if "%PROCESSOR_ARCHITECTURE%" == "AMD64" (
-  drivers\dpinst-amd64.exe %ARGS%
+  "%DRIVERS%\dpinst-amd64.exe" %ARGS%
 ) ELSE IF "%PROCESSOR_ARCHITEW6432%" == "AMD64" (
-  drivers\dpinst-amd64.exe %ARGS%
+  "%DRIVERS%\dpinst-amd64.exe" %ARGS%
 ) ELSE (
-  drivers\dpinst-x86.exe %ARGS%
+  "%DRIVERS%\dpinst-x86.exe" %ARGS%
 )
 
 @echo off
@@ -18,11 +25,11 @@ endlocal
 
 REM dpinst /PATH has problems with relative paths, so use absolute path.
 if "%PROCESSOR_ARCHITECTURE%" == "AMD64" (
-  drivers\dpinst-amd64.exe /PATH %cd%\drivers\prewin10 %ARGS%
+  "%DRIVERS%\dpinst-amd64.exe" /PATH "%DRIVERS%\prewin10" %ARGS%
 ) ELSE IF "%PROCESSOR_ARCHITEW6432%" == "AMD64" (
-  drivers\dpinst-amd64.exe /PATH %cd%\drivers\prewin10 %ARGS%
+  "%DRIVERS%\dpinst-amd64.exe" /PATH "%DRIVERS%\prewin10" %ARGS%
 ) ELSE (
-  drivers/dpinst-x86.exe /PATH %cd%\drivers\prewin10 %ARGS%
+  "%DRIVERS%\dpinst-x86.exe" /PATH "%DRIVERS%\prewin10" %ARGS%
 )
 
 exit /b 0
@@ -1,106 +1,701 @@
 import os
-import glob
 import sys
+import json
+import hashlib
+import shlex
+import argparse
+import tempfile
 import subprocess
-from subprocess import Popen, PIPE
+from subprocess import PIPE, STDOUT
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import time
+from statistics import median
+
+from platform_properties import load_properties
+from file_digests import DigestCache, hash_tree, write_atomic
+from sketch_deps import NON_SOURCE_DIRECTORIES, SketchDependencies
+from build_plan import assign_shards, index_examples, is_skipped, load_durations, menu_variants, parse_shard
+from build_history import HISTORY_FILE, append_run, load_runs, parse_sizes
+from cli_daemon import DaemonBackend
+from file_watch import FileWatcher
 
 SUCCEEDED = "\033[32msucceeded\033[0m"
 FAILED = "\033[31mfailed\033[0m"
 SKIPPED = "\033[35mskipped\033[0m"
 WARNING = "\033[33mwarnings\033[0m "
-
-exit_status = 0
-success_count = 0
-fail_count = 0
-skip_count = 0
+CACHED = "\033[36mcached\033[0m"
 
 build_format = '| {:25} | {:35} | {:18} | {:6} |'
 build_separator = '-' * 88
+# live output interleaves boards, so each row names its board
+live_format = '| {:32} | {:25} | {:35} | {:18} | {:6} |'
+live_separator = '-' * 123
 
 FQBN_PREFIX='adafruit:samd:adafruit_'
+# The boards of this platform's boards.txt, as installed from its package index
+LOCAL_FQBN_PREFIX = os.environ.get('LOCAL_FQBN_PREFIX', 'dumfing:samd:')
+
+# Menus that change the generated code, and the sketches compiled under each of their combinations by --bench
+BENCH_MENUS = ['opt', 'speed', 'cache']
+BENCH_SKETCHES = ['libraries/CI_Tests/examples/test_cmsis_fast_rfft/test_cmsis_fast_rfft.ino']
+bench_format = '| {:48} | {:30} | {:>10} | {:>10} | {:>8} |'
+bench_separator = '-' * 122
+
+# Persistent build directories and core archives, one set per board configuration and core source hash
+BUILD_CACHE_DIR = os.environ.get('BUILD_CACHE_DIR', '.build_cache')
+CORE_READY_MARKER = 'core.ready'
+# The precompiled Arduino.h of platform.txt, shared by the jobs of a configuration, the hook that builds it, and the
+# recipe a platform declares when it supports build.pch.enabled, which the hook runs
+PCH_DIRECTORY = 'pch'
+PCH_FILE = 'Arduino.h.gch'
+PCH_HOOK = 'recipe.hooks.sketch.prebuild.1.pattern'
+PCH_RECIPE = 'recipe.pch.pattern'
+# Input hash of the last successful build of each FQBN and sketch, for --incremental
+BUILD_RESULTS_FILE = 'results.json'
+# Measured compile time of each FQBN and sketch, used to balance --shard
+BUILD_DURATIONS_FILE = 'durations.json'
+
+# Sources watched by --watch, and the changes that affect every sketch
+WATCHED_DIRECTORIES = ['cores', 'variants', 'libraries']
+WATCHED_FILES = ['platform.txt', 'boards.txt']
+# Editor backup and swap files that do not change a build
+IGNORED_SUFFIXES = ('~', '.swp', '.swx', '.tmp')
 
 #default_boards = [ 'metro_m0', 'metro_m4', 'circuitplayground_m0', 'feather_m4_can', 'metro_m0:usbstack=tinyusb', 'metro_m4:speed=120,usbstack=tinyusb' ]
 default_boards = [ 'metro_m0', 'metro_m0:usbstack=tinyusb' ]
-build_boards = []
 
-# build all variants if input not existed
-if len(sys.argv) > 1:
-    build_boards.append(sys.argv[1])
-else:
-    build_boards = default_boards
+local_boards = load_properties('boards.txt') if os.path.exists('boards.txt') else None
+local_platform = load_properties('platform.txt') if os.path.exists('platform.txt') else None
+
+def platform_has_pch(fqbn_prefix):
+    """Whether the platform the FQBNs build with is this one, and its platform.txt declares the precompiled Arduino.h."""
+    return fqbn_prefix == LOCAL_FQBN_PREFIX and local_platform is not None and PCH_RECIPE in local_platform
+
+def parse_board(variant):
+    """Split a board spec such as 'metro_m0:usbstack=tinyusb' into the board ID and its menu options."""
+    board_id, _, option_string = variant.partition(':')
+    options = dict(option.split('=', 1) for option in option_string.split(',') if option)
+    return board_id, options
+
+def uses_tinyusb(variant):
+    """Resolve the board's USB stack from boards.txt when it is defined there, otherwise from the menu options."""
+    board_id, options = parse_board(variant)
+    if local_boards is not None and board_id in local_boards.boards:
+        return '-DUSE_TINYUSB' in local_boards.board(board_id, options).get('build.flags.usbstack', '')
+    return options.get('usbstack') == 'tinyusb'
+
+def core_source_hash(digests):
+    """Hash the cores/ and variants/ trees, reusing file digests from the previous run while their stat data is unchanged."""
+    sources = hashlib.sha256()
+    for directory in ('cores', 'variants'):
+        if os.path.isdir(directory):
+            tree_hash, _ = hash_tree(directory, digests)
+            sources.update("{}\0{}\n".format(directory, tree_hash).encode())
+    return sources.hexdigest()
+
+def platform_files_hash(digests):
+    """Hash platform.txt and boards.txt, which change the build of every sketch."""
+    files = hashlib.sha256()
+    for file_path in ('platform.txt', 'boards.txt'):
+        if os.path.exists(file_path):
+            files.update("{}\0{}\n".format(file_path, digests.digest(file_path, os.stat(file_path))).encode())
+    return files.hexdigest()
+
+def config_directory(cache_dir, fqbn, variant, sources):
+    """The cache directory of one board configuration, e.g. .build_cache/metro_m0-usbstack-tinyusb-<hash>."""
+    key = hashlib.sha256("{}\0{}".format(fqbn, sources).encode()).hexdigest()[:16]
+    name = variant.replace(':', '-').replace(',', '-').replace('=', '-')
+    return os.path.join(cache_dir, "{}-{}".format(name, key))
+
+def plan_jobs(boards, examples, markers, cache_dir=None, incremental=False, fqbn_prefix=FQBN_PREFIX, pch=False):
+    """
+    Expand the board x sketch matrix into jobs, in the order their results are reported.
+
+    With incremental=True each job also gets the hash of all its inputs: the sketch, the libraries it includes, the
+    core and variants, platform.txt and boards.txt.
+
+    Args:
+        boards (list): The board specs.
+        examples (list): The sketches, in report order.
+        markers (dict): The test markers of each sketch directory, from build_plan.index_examples.
+        cache_dir (str): The build cache directory, or None to build without caching.
+        incremental (bool): Whether to compute the input hash of each job.
+        fqbn_prefix (str): Prepended to the board specs to form the FQBNs. Defaults to FQBN_PREFIX.
+        pch (bool): Whether the jobs compile with the precompiled Arduino.h of platform.txt. Only platforms that
+            declare it, see platform_has_pch.
+    """
+    digests = DigestCache(os.path.join(cache_dir, 'digests.json')) if cache_dir else None
+    sources = core_source_hash(digests) if cache_dir else None
+    if incremental:
+        platform_inputs = "{}\0{}".format(sources, platform_files_hash(digests))
+        dependencies = SketchDependencies(digests)
+        sketch_hashes = {}
+
+    jobs = []
+    for variant in boards:
+        tinyusb = uses_tinyusb(variant)
+        fqbn = "{}{}".format(fqbn_prefix, variant)
+        config = config_directory(cache_dir, fqbn, variant, sources) if cache_dir else None
+        for sketch in examples:
+            job = {
+                'variant': variant,
+                'fqbn': fqbn,
+                'sketch': sketch,
+                'skipped': is_skipped(sketch, variant, tinyusb, markers),
+                'config': config,
+                'inputs': None,
+                'pch': pch,
+            }
+            if incremental and not job['skipped']:
+                if sketch not in sketch_hashes:
+                    sketch_hashes[sketch] = dependencies.sketch_hash(sketch)
+                job['inputs'] = hashlib.sha256("{}\0{}\0{}".format(job['fqbn'], platform_inputs, sketch_hashes[sketch]).encode()).hexdigest()
+            jobs.append(job)
+    if digests is not None:
+        digests.save()
+    return jobs
+
+def job_key(job):
+    return "{} {}".format(job['fqbn'], job['sketch'])
+
+def load_build_results(cache_dir):
+    file_path = os.path.join(cache_dir, BUILD_RESULTS_FILE)
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path) as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return {}
 
-all_examples = list(glob.iglob('libraries/**/*.ino', recursive=True))
-all_examples.sort()
+def run_arduino_cli(fqbn, sketch, build_path, core_cache=None, build_properties=()):
+    """Compile one sketch in a new arduino-cli process. The default backend, see cli_daemon.DaemonBackend for the other."""
+    command = "arduino-cli compile --warnings all --build-path {} ".format(build_path)
+    if core_cache:
+        command += "--build-cache-path {} ".format(core_cache)
+    for build_property in build_properties:
+        command += "--build-property {} ".format(shlex.quote(build_property))
+    command += "--fqbn {} {}".format(fqbn, sketch)
+    build_result = subprocess.run(command, shell=True, stdout=PIPE, stderr=PIPE)
+    program_size, data_size = parse_sizes(build_result.stdout)
+    return {'returncode': build_result.returncode, 'stdout': build_result.stdout, 'stderr': build_result.stderr,
+            'program_size': program_size, 'data_size': data_size}
 
-def build_examples(variant):
-    global exit_status, success_count, fail_count, skip_count, build_format, build_separator
+def install_platform(additional_urls):
+    """
+    Install this platform, the one of LOCAL_FQBN_PREFIX, from the given Boards Manager index URLs, e.g. a
+    boards_mirror.py mirror.
 
+    The URLs are exported as ARDUINO_BOARD_MANAGER_ADDITIONAL_URLS, so every arduino-cli process and daemon started
+    afterwards resolves the platform's tools from the same index.
+
+    Returns:
+        bool: Whether the platform is installed.
+    """
+    os.environ['ARDUINO_BOARD_MANAGER_ADDITIONAL_URLS'] = additional_urls
+    core = ':'.join(LOCAL_FQBN_PREFIX.split(':')[:2])
+    for command in (['arduino-cli', 'core', 'update-index'], ['arduino-cli', 'core', 'install', core]):
+        result = subprocess.run(command, stdout=PIPE, stderr=STDOUT)
+        if result.returncode != 0:
+            print("{} failed:\n{}".format(' '.join(command), result.stdout.decode(errors='replace')))
+            return False
+    print("Installed {} from {}".format(core, additional_urls))
+    return True
+
+def config_ready(job):
+    """Whether the configuration of a job has a cached core, and its precompiled Arduino.h if the job uses one."""
+    if not os.path.exists(os.path.join(job['config'], CORE_READY_MARKER)):
+        return False
+    return not job['pch'] or os.path.exists(os.path.join(job['config'], PCH_DIRECTORY, PCH_FILE))
+
+def pch_properties(job, priming=False):
+    """
+    Build properties selecting how a job gets the precompiled Arduino.h of platform.txt, which is off by default.
+
+    platform.txt declares the precompiling recipe without a hook running it. The job that primes a configuration
+    adds the hook to precompile the header into the configuration's cache directory, and the later jobs of that
+    configuration use it without the hook. Without a cache directory, or when priming did not produce a header, every
+    build precompiles its own.
+    """
+    if not job['pch']:
+        return []
+    hook = PCH_HOOK + '={' + PCH_RECIPE + '}'
+    if job['config'] is None:
+        return ['build.pch.enabled=true', hook]
+    pch_path = os.path.abspath(os.path.join(job['config'], PCH_DIRECTORY))
+    if priming:
+        os.makedirs(pch_path, exist_ok=True)
+        return ['build.pch.enabled=true', 'build.pch.path=' + pch_path, hook]
+    if os.path.exists(os.path.join(pch_path, PCH_FILE)):
+        return ['build.pch.enabled=true', 'build.pch.path=' + pch_path]
+    return ['build.pch.enabled=true', hook]
+
+def compile_sketch(job, backend=run_arduino_cli, priming=False):
+    """Compile one job with the given backend and capture its output. Runs on a worker thread."""
+    start_time = time.monotonic()
+    build_properties = pch_properties(job, priming)
+    if job['config'] is None:
+        # jobs for the same sketch run concurrently, so each gets its own build directory
+        with tempfile.TemporaryDirectory(prefix='build_all_') as build_path:
+            result = backend(job['fqbn'], job['sketch'], build_path, build_properties=build_properties)
+    else:
+        # each sketch keeps its build directory between runs, and the core archive is shared by the configuration
+        sketch_key = hashlib.sha256(job['sketch'].encode()).hexdigest()[:12]
+        build_path = os.path.join(job['config'], 'sketches', "{}-{}".format(os.path.basename(job['sketch']), sketch_key))
+        result = backend(job['fqbn'], job['sketch'], build_path, os.path.join(job['config'], 'core'), build_properties)
+        if result['returncode'] == 0:
+            open(os.path.join(job['config'], CORE_READY_MARKER), 'w').close()
+    result['duration'] = time.monotonic() - start_time
+    return result
+
+def job_status(result):
+    if result is None:
+        return SKIPPED
+    if result.get('cached'):
+        return CACHED
+    if result['returncode'] != 0:
+        return FAILED
+    return WARNING if result['stderr'] else SUCCEEDED
+
+def print_board_header(variant):
     print('\n')
     print(build_separator)
     print('| {:^84} |'.format('Board ' + variant))
     print(build_separator)
     print(build_format.format('Library', 'Example', '\033[39mResult\033[0m', 'Time'))
     print(build_separator)
-    
-    fqbn = "{}{}".format(FQBN_PREFIX, variant)
-
-    for sketch in all_examples:
-        start_time = time.monotonic()
-
-        # Skip if contains: ".board.test.skip" or ".all.test.skip"
-        # Skip if not contains: ".board.test.only" for a specific board
-        sketchdir = os.path.dirname(sketch)
-        if os.path.exists(sketchdir + '/.all.test.skip') or os.path.exists(sketchdir + '/.' + variant + '.test.skip'):
-            success = SKIPPED
-            skip_count += 1
-        elif glob.glob(sketchdir+"/.*.test.only") and not os.path.exists(sketchdir + '/.' + variant + '.test.only'):
-            success = SKIPPED
-            skip_count += 1
-        elif 'usbstack=tinyusb' not in variant and "libraries/Adafruit_TinyUSB_Arduino" in sketch:
-            # skip non-tinyusb variant for tinyusb examples
-            success = SKIPPED
-            skip_count += 1
-        elif 'usbstack=tinyusb' in variant and "libraries/USBHost" in sketch:
-            # skip -tinyusb variant for USBHost examples
-            success = SKIPPED
-            skip_count += 1
-        else:
-            build_result = subprocess.run("arduino-cli compile --warnings all --fqbn {} {}".format(fqbn, sketch), shell=True, stdout=PIPE, stderr=PIPE)
 
-            # get stderr into a form where warning/error was output to stderr
-            if build_result.returncode != 0:
-                exit_status = build_result.returncode
-                success = FAILED
-                fail_count += 1
+def print_result(job, result, live=False):
+    sketch = job['sketch']
+    duration = '{:5.2f}s'.format(result['duration'] if result else 0)
+    if live:
+        print(live_format.format(job['variant'], sketch.split(os.path.sep)[1], os.path.basename(sketch), job_status(result), duration))
+    else:
+        print(build_format.format(sketch.split(os.path.sep)[1], os.path.basename(sketch), job_status(result), duration))
+
+    if result is not None:
+        # Build failed
+        if result['returncode'] != 0:
+            print(result['stdout'].decode("utf-8"))
+
+        # Build with warnings
+        if result['stderr']:
+            print(result['stderr'].decode("utf-8"))
+
+# result of a job cancelled by --fail-fast, which is left out of the output
+CANCELLED = object()
+
+class OrderedReporter:
+    """
+    Prints job results in matrix order as soon as every earlier job has finished, so the output is the same for any
+    number of workers. With live=True results are printed in completion order instead.
+    """
+    def __init__(self, jobs, live=False):
+        self.jobs = jobs
+        self.live = live
+        self.results = {}
+        self.next_index = 0
+        self.current_variant = None
+
+    def report(self, index, result):
+        if self.live:
+            if result is not CANCELLED:
+                print_result(self.jobs[index], result, live=True)
+            return
+        self.results[index] = result
+        while self.next_index in self.results:
+            job = self.jobs[self.next_index]
+            result = self.results.pop(self.next_index)
+            self.next_index += 1
+            if result is CANCELLED:
+                continue
+            if job['variant'] != self.current_variant:
+                self.current_variant = job['variant']
+                print_board_header(job['variant'])
+            print_result(job, result)
+        sys.stdout.flush()
+
+def run_jobs(jobs, workers, fail_fast=False, live=False, build_results=None, backend=run_arduino_cli):
+    """
+    Runs the compile jobs on a pool of worker threads and reports each result.
+
+    When a board configuration has no cached core yet, its first job runs alone and builds the core archive, and the
+    other jobs of that configuration are held back until it finishes so they all reuse it.
+
+    Jobs whose input hash matches their last successful build in build_results are reported as cached without
+    compiling, and build_results is updated with every successful build.
+
+    Args:
+        jobs (list): The jobs from plan_jobs.
+        workers (int): The number of compiles run at once.
+        fail_fast (bool): Cancel the jobs that have not started once one fails.
+        live (bool): Print results as they finish rather than in matrix order.
+        build_results (dict): The input hash of the last successful build of each job, see job_key. Only used for
+            jobs that have an input hash.
+        backend: Compiles one sketch, run_arduino_cli or DaemonBackend.compile.
+
+    Returns:
+        dict: The number of succeeded, failed, skipped, cached and cancelled jobs, the core cache hits and misses, the exit
+        status, the duration of each compiled job by job_key, the build_history records of the successful builds and the
+        number of jobs compiled without the daemon after it failed.
+    """
+    summary = {'succeeded': 0, 'failed': 0, 'skipped': 0, 'cached': 0, 'cancelled': 0, 'core_hits': 0, 'core_misses': 0, 'exit_status': 0,
+               'durations': {}, 'history': [], 'daemon_fallbacks': 0}
+    build_results = {} if build_results is None else build_results
+    reporter = OrderedReporter(jobs, live)
+    if live:
+        print(live_separator)
+        print(live_format.format('Board', 'Library', 'Example', '\033[39mResult\033[0m', 'Time'))
+        print(live_separator)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        # jobs held back until the first job of their configuration has built the core, by configuration
+        held = {}
+        # configurations whose first job already ran, so their other jobs do not wait on priming again when it failed
+        primed = set()
+
+        def submit(index):
+            job = jobs[index]
+            priming = False
+            if job['config'] is not None:
+                if job['config'] in held:
+                    held[job['config']].append(index)
+                    return
+                elif config_ready(job):
+                    summary['core_hits'] += 1
+                else:
+                    summary['core_misses'] += 1
+                    if job['config'] not in primed:
+                        os.makedirs(job['config'], exist_ok=True)
+                        held[job['config']] = []
+                        primed.add(job['config'])
+                        priming = True
+            pending[pool.submit(compile_sketch, job, backend, priming)] = index
+
+        for index, job in enumerate(jobs):
+            if job['skipped']:
+                summary['skipped'] += 1
+                reporter.report(index, None)
+            elif job['inputs'] is not None and build_results.get(job_key(job)) == job['inputs']:
+                summary['cached'] += 1
+                reporter.report(index, {'returncode': 0, 'stdout': b'', 'stderr': b'', 'duration': 0, 'cached': True})
             else:
-                success_count += 1
-                if build_result.stderr:
-                    success = WARNING
+                submit(index)
+
+        failed_index = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=pending.get):
+                index = pending.pop(future)
+                result = future.result()
+                summary['durations'][job_key(jobs[index])] = round(result['duration'], 3)
+                if result.get('daemon_error'):
+                    summary['daemon_fallbacks'] += 1
+                if result['returncode'] != 0:
+                    summary['failed'] += 1
+                    # report the status of the last failing job in matrix order, as a sequential run would
+                    if failed_index is None or index > failed_index:
+                        failed_index = index
+                        summary['exit_status'] = result['returncode']
                 else:
-                    success = SUCCEEDED
+                    summary['succeeded'] += 1
+                    summary['history'].append({'board': jobs[index]['variant'], 'sketch': jobs[index]['sketch'], 'duration': round(result['duration'], 3),
+                                               'program_size': result['program_size'], 'data_size': result['data_size']})
+                    if result.get('daemon_error'):
+                        summary['history'][-1]['backend'] = 'subprocess'
+                    if jobs[index]['inputs'] is not None:
+                        build_results[job_key(jobs[index])] = jobs[index]['inputs']
+                reporter.report(index, result)
+
+                config = jobs[index]['config']
+                if config in held and not (fail_fast and summary['failed']):
+                    for held_index in held.pop(config):
+                        submit(held_index)
 
-        build_duration = time.monotonic() - start_time
+            if fail_fast and summary['failed']:
+                cancelled = [pending.pop(future) for future in list(pending) if future.cancel()]
+                cancelled += [index for indices in held.values() for index in indices]
+                held.clear()
+                for index in sorted(cancelled):
+                    summary['cancelled'] += 1
+                    reporter.report(index, CANCELLED)
+    return summary
 
-        print(build_format.format(sketch.split(os.path.sep)[1], os.path.basename(sketch), success, '{:5.2f}s'.format(build_duration)))
+def daemon_saving(history_file, history):
+    """
+    Return the median per-job time saved by the daemon backend, comparing this run's jobs with their latest build
+    through subprocesses in the history, and the number of jobs compared. The saving is None without a baseline.
+    """
+    baseline = {}
+    for records in load_runs(history_file).values() if history_file else ():
+        for record in records:
+            if record.get('backend', 'subprocess') == 'subprocess':
+                baseline[(record['board'], record['sketch'])] = record['duration']
+    savings = [baseline[(record['board'], record['sketch'])] - record['duration'] for record in history
+               if record['backend'] == 'daemon' and (record['board'], record['sketch']) in baseline]
+    return (median(savings) if savings else None), len(savings)
+
+def print_bench_table(jobs, history):
+    """Print the firmware size and build time of every benchmark job, grouped by sketch."""
+    results = {(record['board'], record['sketch']): record for record in history}
+    for sketch in sorted({job['sketch'] for job in jobs}):
+        print('\n')
+        print(bench_separator)
+        print('| {:^118} |'.format('Benchmark ' + os.path.basename(sketch)))
+        print(bench_separator)
+        print(bench_format.format('Board', 'Options', 'Flash', 'RAM', 'Time'))
+        print(bench_separator)
+        for job in jobs:
+            if job['sketch'] != sketch:
+                continue
+            board_id, _, options = job['variant'].partition(':')
+            record = results.get((job['variant'], sketch))
+            if record is None:
+                print(bench_format.format(board_id, options, FAILED, '', ''))
+            else:
+                print(bench_format.format(board_id, options, record['program_size'] if record['program_size'] is not None else '?',
+                                          record['data_size'] if record['data_size'] is not None else '?', '{:.2f}s'.format(record['duration'])))
 
-        if success != SKIPPED:
-            # Build failed
-            if build_result.returncode != 0:
-                print(build_result.stdout.decode("utf-8"))
+def affected_sketches(changed, examples):
+    """
+    Map changed files to the sketches whose build they can change.
 
-            # Build with warnings
-            if build_result.stderr:
-                print(build_result.stderr.decode("utf-8"))
+    Changes to the core, the variants, platform.txt or boards.txt affect every sketch. A change inside a sketch
+    directory affects that sketch, and a change to a library's sources affects every sketch that includes it.
+    """
+    if any(file_path in WATCHED_FILES or file_path.startswith(('cores' + os.sep, 'variants' + os.sep)) for file_path in changed):
+        return examples
 
-build_time = time.monotonic()
+    changed_libraries = set()
+    for file_path in changed:
+        parts = file_path.split(os.sep)
+        if parts[0] == 'libraries' and len(parts) > 2 and parts[2] not in NON_SOURCE_DIRECTORIES:
+            changed_libraries.add(parts[1])
+    dependencies = SketchDependencies(DigestCache()) if changed_libraries else None
 
-for board in build_boards:
-    build_examples(board)
+    affected = []
+    for sketch in examples:
+        sketch_directory = os.path.dirname(sketch) + os.sep
+        if any(file_path.startswith(sketch_directory) for file_path in changed):
+            affected.append(sketch)
+        elif dependencies is not None and changed_libraries.intersection(dependencies.sketch_libraries(sketch)):
+            affected.append(sketch)
+    return affected
+
+def is_ignored_change(file_path):
+    name = os.path.basename(file_path)
+    if name.endswith(IGNORED_SUFFIXES):
+        return True
+    return name.startswith('.') and not name.endswith(('.test.skip', '.test.only'))
+
+def build(jobs, args, cache_dir, backend, daemon=None, build_results=None, record_history=True):
+    """
+    Run the jobs, save the results, durations and history, and print the summary.
+
+    Returns:
+        dict: The summary from run_jobs.
+    """
+    build_time = time.monotonic()
+    durations_file = args.durations or (os.path.join(cache_dir, BUILD_DURATIONS_FILE) if cache_dir else None)
+    try:
+        summary = run_jobs(jobs, max(1, args.jobs), args.fail_fast, args.live, build_results, backend)
+    finally:
+        if build_results is not None:
+            write_atomic(os.path.join(cache_dir, BUILD_RESULTS_FILE), json.dumps(build_results, indent=1, sort_keys=True).encode())
+    history_file = args.history or (os.path.join(cache_dir, HISTORY_FILE) if cache_dir else None)
+    for record in summary['history']:
+        record.setdefault('backend', 'daemon' if daemon is not None else 'subprocess')
+    saving = daemon_saving(history_file, summary['history']) if daemon is not None else None
+    if record_history and history_file and summary['history']:
+        append_run(history_file, args.run_name, sorted(summary['history'], key=lambda record: (record['board'], record['sketch'])))
+    if durations_file and summary['durations']:
+        durations = load_durations(durations_file)
+        durations.update(summary['durations'])
+        write_atomic(durations_file, json.dumps(durations, indent=1, sort_keys=True).encode())
+
+    if args.bench:
+        print_bench_table(jobs, summary['history'])
+
+    print(build_separator)
+    build_time = time.monotonic() - build_time
+    if build_results is not None:
+        print("Build Summary: {} {}, {} {}, {} {}, {} {} and took {:.2f}s".format(summary['succeeded'], SUCCEEDED, summary['failed'], FAILED, summary['skipped'], SKIPPED, summary['cached'], CACHED, build_time))
+    else:
+        print("Build Summary: {} {}, {} {}, {} {} and took {:.2f}s".format(summary['succeeded'], SUCCEEDED, summary['failed'], FAILED, summary['skipped'], SKIPPED, build_time))
+    if cache_dir:
+        print("Core cache: {} hits, {} misses".format(summary['core_hits'], summary['core_misses']))
+    if summary['cancelled']:
+        print("{} builds cancelled after the first failure".format(summary['cancelled']))
+    if summary['daemon_fallbacks']:
+        print("arduino-cli daemon: failed ({}), {} jobs compiled with subprocesses instead".format(daemon.error, summary['daemon_fallbacks']))
+    if saving is not None:
+        if saving[0] is None:
+            print("arduino-cli daemon: no subprocess builds of these jobs in the history to compare with")
+        else:
+            print("arduino-cli daemon: saved {:.2f}s per job (median of {} jobs against their last subprocess build)".format(*saving))
+    print(build_separator)
+    return summary
+
+def compare_pch(args, planned, examples, markers, fqbn_prefix, backend, daemon=None):
+    """
+    Build the matrix twice from empty caches, without and then with the precompiled Arduino.h, and compare the times.
+
+    Args:
+        planned (list): The jobs of the matrix, whose skipped flags are kept.
+
+    Returns:
+        int: The exit status of the first run that failed, or 0.
+    """
+    totals = {}
+    exit_status = 0
+    for pch in (False, True):
+        print("\nPrecompiled Arduino.h {}".format('on' if pch else 'off'))
+        with tempfile.TemporaryDirectory(prefix='build_all_pch_') as cache_dir:
+            jobs = plan_jobs(args.boards, examples, markers, cache_dir, fqbn_prefix=fqbn_prefix, pch=pch)
+            for job, planned_job in zip(jobs, planned):
+                job['skipped'] = planned_job['skipped']
+            start = time.monotonic()
+            summary = build(jobs, args, cache_dir, backend, daemon, record_history=False)
+            totals[pch] = (time.monotonic() - start, sum(summary['durations'].values()))
+            exit_status = exit_status or summary['exit_status']
+
+    print(build_separator)
+    for pch in (False, True):
+        print("PCH {:3}: {:8.2f}s wall, {:8.2f}s of compiles".format('on' if pch else 'off', *totals[pch]))
+    if totals[False][1]:
+        print("Precompiled Arduino.h saves {:.1f}% of the matrix compile time".format((totals[False][1] - totals[True][1]) * 100 / totals[False][1]))
+    print(build_separator)
+    return exit_status
+
+def watch(args, cache_dir, backend, daemon=None, fqbn_prefix=FQBN_PREFIX):
+    """
+    Rebuild the sketches affected by each burst of changes to the platform sources, until interrupted.
+
+    Builds are incremental, so the jobs of an affected sketch whose inputs did not actually change are still cached,
+    and the core cache stays warm between iterations.
+    """
+    watcher = FileWatcher(WATCHED_DIRECTORIES, WATCHED_FILES)
+    print("Watching {} and {} for changes ({})".format(', '.join(WATCHED_DIRECTORIES), ', '.join(WATCHED_FILES), watcher.method))
+    try:
+        while True:
+            changed = {file_path for file_path in watcher.wait(args.debounce) if not is_ignored_change(file_path)}
+            if not changed:
+                continue
+            detected = time.monotonic()
+            examples, markers = index_examples()
+            sketches = affected_sketches(changed, examples)
+            print("\n{} changed file(s): {}".format(len(changed), ', '.join(sorted(changed)[:5]) + (' ...' if len(changed) > 5 else '')))
+            if not sketches:
+                print("No examples affected")
+                continue
+            build_results = load_build_results(cache_dir)
+            jobs = plan_jobs(args.boards, sketches, markers, cache_dir, incremental=True, fqbn_prefix=fqbn_prefix, pch=args.pch)
+            build(jobs, args, cache_dir, backend, daemon, build_results, record_history=False)
+            print("{} affected example(s) up to date {:.2f}s after the change".format(len(sketches), time.monotonic() - detected))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile every library example for each board")
+    parser.add_argument('boards', nargs='*', default=default_boards, help="board specs such as metro_m0:usbstack=tinyusb")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="number of compiles run at once (default: CPU count)")
+    parser.add_argument('--fail-fast', action='store_true', help="cancel the remaining compiles after the first failure")
+    parser.add_argument('--live', action='store_true', help="print results as they finish instead of in matrix order")
+    parser.add_argument('--cache-dir', default=BUILD_CACHE_DIR, help="persistent build and core cache directory (default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true', help="build every sketch from scratch in a temporary directory")
+    parser.add_argument('--incremental', action='store_true', help="skip sketches whose inputs are unchanged since their last successful build")
+    parser.add_argument('--plan', action='store_true', help="print the job matrix as JSON instead of building")
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N', help="only build shard I of N, balanced by recorded durations")
+    parser.add_argument('--durations', help="recorded job durations used by --shard (default: durations.json in the cache directory)")
+    parser.add_argument('--history', help="append compile times and firmware sizes to this JSONL file (default: {} in the cache directory)".format(HISTORY_FILE))
+    # the process ID keeps runs started in the same second apart
+    parser.add_argument('--run-name', default="{}-{}".format(time.strftime('%Y%m%dT%H%M%S'), os.getpid()), help="name of this run in the history (default: the start time and process ID)")
+    parser.add_argument('--backend', choices=('subprocess', 'daemon'), default=os.environ.get('BUILD_BACKEND', 'subprocess'),
+                        help="run arduino-cli per job, or send every job to one arduino-cli daemon (default: %(default)s)")
+    parser.add_argument('--bench', action='store_true', help="compile the benchmark sketches for every menu combination of the boards in boards.txt")
+    parser.add_argument('--bench-menus', type=lambda value: value.split(','), default=BENCH_MENUS, help="menus to expand with --bench (default: {})".format(','.join(BENCH_MENUS)))
+    parser.add_argument('--bench-sketch', action='append', help="sketch to benchmark, may be repeated (default: {})".format(', '.join(BENCH_SKETCHES)))
+    parser.add_argument('--additional-urls', default=os.environ.get('ARDUINO_BOARD_MANAGER_ADDITIONAL_URLS'),
+                        help="comma separated Boards Manager index URLs, such as a boards_mirror.py mirror, to install the platform from before building")
+    parser.add_argument('--pch', action='store_true', help="compile with the precompiled Arduino.h that platform.txt enables with build.pch.enabled, for the boards of this platform")
+    parser.add_argument('--pch-compare', action='store_true', help="build the matrix from empty caches without and with the precompiled Arduino.h and compare the times")
+    parser.add_argument('--watch', action='store_true', help="after the first build, rebuild the examples affected by each change to the sources")
+    parser.add_argument('--debounce', type=float, default=0.3, help="seconds without changes before --watch rebuilds (default: %(default)s)")
+    args = parser.parse_args()
+    if (args.incremental or args.watch) and args.no_cache:
+        parser.error("--incremental and --watch record their results in the cache directory and cannot be used with --no-cache")
+    if args.watch and (args.bench or args.shard or args.plan):
+        parser.error("--watch cannot be combined with --bench, --shard or --plan")
+    if args.pch_compare and (args.watch or args.shard or args.plan or args.incremental):
+        parser.error("--pch-compare builds the whole matrix from empty caches and cannot be combined with --watch, --shard, --plan or --incremental")
+    # the precompiled Arduino.h is declared by this platform, so its builds use the boards of boards.txt
+    local = args.bench or args.pch or args.pch_compare
+    fqbn_prefix = LOCAL_FQBN_PREFIX if local else FQBN_PREFIX
+    if (args.pch or args.pch_compare) and not platform_has_pch(fqbn_prefix):
+        parser.error("--pch and --pch-compare need a platform.txt that declares {}, run them from the platform directory".format(PCH_RECIPE))
+    # watch mode relies on incremental builds to leave unaffected jobs alone
+    args.incremental = args.incremental or args.watch
+
+    if args.bench:
+        if local_boards is None:
+            parser.error("--bench reads the menus from boards.txt, run it from the platform directory")
+        # positional boards narrow the benchmark to those boards.txt entries
+        board_ids = [board for board in args.boards if board in local_boards.boards] if args.boards != default_boards else local_boards.boards
+        args.boards = menu_variants(local_boards, board_ids, args.bench_menus)
+        all_examples, markers = args.bench_sketch or BENCH_SKETCHES, {}
+    else:
+        if local and args.boards == default_boards:
+            if local_boards is None:
+                parser.error("--pch and --pch-compare build the boards of boards.txt, run them from the platform directory")
+            args.boards = local_boards.boards
+        all_examples, markers = index_examples()
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    build_results = load_build_results(cache_dir) if args.incremental else None
+    jobs = plan_jobs(args.boards, all_examples, markers, cache_dir, args.incremental, fqbn_prefix, args.pch)
+    if args.bench:
+        # benchmark sketches are compiled for every combination, whatever their test markers say
+        for job in jobs:
+            job['skipped'] = False
+    if args.shard:
+        shard, shard_count = args.shard
+        durations_file = args.durations or (os.path.join(cache_dir, BUILD_DURATIONS_FILE) if cache_dir else None)
+        loads = assign_shards(jobs, shard_count, load_durations(durations_file), job_key)
+        jobs = [job for job in jobs if job['shard'] == shard]
+        print("Shard {}/{}: {} jobs, estimated {:.1f}s of {:.1f}s".format(shard, shard_count, len(jobs), loads[shard - 1], sum(loads)), file=sys.stderr)
+    if args.plan:
+        json.dump(jobs, sys.stdout, indent=1)
+        print()
+        return
+
+    if args.additional_urls and not install_platform(args.additional_urls):
+        sys.exit(1)
+
+    backend, daemon = run_arduino_cli, None
+    if args.backend == 'daemon':
+        daemon = DaemonBackend(fallback=run_arduino_cli)
+        if daemon.start():
+            backend = daemon.compile
+        else:
+            daemon = None
+    try:
+        if args.pch_compare:
+            exit_status = compare_pch(args, jobs, all_examples, markers, fqbn_prefix, backend, daemon)
+        else:
+            exit_status = build(jobs, args, cache_dir, backend, daemon, build_results)['exit_status']
+        if args.watch:
+            watch(args, cache_dir, backend, daemon, fqbn_prefix)
+    finally:
+        if daemon is not None:
+            daemon.stop()
 
-print(build_separator)
-build_time = time.monotonic() - build_time
-print("Build Summary: {} {}, {} {}, {} {} and took {:.2f}s".format(success_count, SUCCEEDED, fail_count, FAILED, skip_count, SKIPPED, build_time))
-print(build_separator)
+    sys.exit(exit_status)
 
-sys.exit(exit_status)
+if __name__ == '__main__':
+    main()
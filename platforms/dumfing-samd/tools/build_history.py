@@ -0,0 +1,162 @@
+"""
+Build time and firmware size history of build_all.py, with a report that flags regressions against a baseline run.
+
+Every run appends one JSON line per compiled job to the history file. Usage:
+
+    python tools/build_history.py runs
+    python tools/build_history.py report [--run RUN] [--baseline RUN] [--time-threshold 20] [--size-threshold 1]
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+HISTORY_FILE = 'history.jsonl'
+
+# arduino-cli prints these after a successful compile
+PROGRAM_SIZE_PATTERN = re.compile(rb'Sketch uses (\d+) bytes')
+DATA_SIZE_PATTERN = re.compile(rb'Global variables use (\d+) bytes')
+
+# Compile time changes below this many seconds are noise, whatever the percentage
+MIN_TIME_DELTA = 0.5
+
+def parse_sizes(output):
+    """Return the program and data size in bytes from arduino-cli compile output, None for sizes it does not report."""
+    program = PROGRAM_SIZE_PATTERN.search(output)
+    data = DATA_SIZE_PATTERN.search(output)
+    return int(program.group(1)) if program else None, int(data.group(1)) if data else None
+
+def current_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    return result.stdout.decode().strip() or None
+
+def append_run(file_path, run, records):
+    """
+    Append the records of one run to the history file.
+
+    Args:
+        file_path (str): The JSONL history file.
+        run (str): The run identifier shared by every record.
+        records (list): One dict per job with board, sketch, duration, program_size and data_size.
+    """
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    commit = current_commit()
+    with open(file_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps({'run': run, 'commit': commit, **record}, sort_keys=True) + '\n')
+
+def load_runs(file_path):
+    """Return the records of each run in the history file, in the order the runs were recorded."""
+    runs = {}
+    if not os.path.exists(file_path):
+        return runs
+    with open(file_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            runs.setdefault(record['run'], []).append(record)
+    return runs
+
+def percent_change(old, new):
+    return (new - old) * 100 / old if old else 0.0
+
+def compare_runs(baseline, current, time_threshold, size_threshold):
+    """
+    Compare the jobs two runs have in common.
+
+    Args:
+        baseline (list): The records of the baseline run.
+        current (list): The records of the run being checked.
+        time_threshold (float): Percentage compile time increase reported as a regression.
+        size_threshold (float): Percentage program or data size increase reported as a regression.
+
+    Returns:
+        list: One (board, sketch, metric, baseline value, current value, percent change) tuple per regression.
+    """
+    baseline_jobs = {(record['board'], record['sketch']): record for record in baseline}
+    regressions = []
+    for record in current:
+        old = baseline_jobs.get((record['board'], record['sketch']))
+        if old is None:
+            continue
+        change = percent_change(old['duration'], record['duration'])
+        if change > time_threshold and record['duration'] - old['duration'] > MIN_TIME_DELTA:
+            regressions.append((record['board'], record['sketch'], 'duration', old['duration'], record['duration'], change))
+        for metric in ('program_size', 'data_size'):
+            if old.get(metric) is None or record.get(metric) is None:
+                continue
+            change = percent_change(old[metric], record[metric])
+            if change > size_threshold:
+                regressions.append((record['board'], record['sketch'], metric, old[metric], record[metric], change))
+    return regressions
+
+def report(file_path, run=None, baseline=None, time_threshold=20.0, size_threshold=1.0):
+    """
+    Print the regressions of a run against a baseline run.
+
+    Args:
+        run (str): The run to check. Defaults to the latest run.
+        baseline (str): The run to compare with. Defaults to the run before the checked one.
+
+    Returns:
+        int: The number of regressions found.
+    """
+    runs = load_runs(file_path)
+    names = list(runs)
+    if not names:
+        print("No build history in {}".format(file_path))
+        return 0
+    run = run or names[-1]
+    if run not in runs:
+        raise SystemExit("Run {} is not in {}".format(run, file_path))
+    if baseline is None:
+        earlier = names[:names.index(run)]
+        if not earlier:
+            print("Run {} has no earlier run to compare with".format(run))
+            return 0
+        baseline = earlier[-1]
+    if baseline not in runs:
+        raise SystemExit("Run {} is not in {}".format(baseline, file_path))
+
+    regressions = compare_runs(runs[baseline], runs[run], time_threshold, size_threshold)
+    print("Comparing run {} with baseline {}".format(run, baseline))
+    row_format = '| {:32} | {:45} | {:12} | {:>10} | {:>10} | {:>7} |'
+    print(row_format.format('Board', 'Sketch', 'Metric', 'Baseline', 'Current', 'Change'))
+    print('-' * 135)
+    for board, sketch, metric, old, new, change in regressions:
+        print(row_format.format(board[:32], sketch[-45:], metric, old, new, '{:+.1f}%'.format(change)))
+    print("{} regression(s) above {}% compile time or {}% size".format(len(regressions), time_threshold, size_threshold))
+    return len(regressions)
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the build history recorded by build_all.py")
+    parser.add_argument('--history', default=os.path.join(os.environ.get('BUILD_CACHE_DIR', '.build_cache'), HISTORY_FILE), help="history file (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('runs', help="list the recorded runs")
+    report_parser = commands.add_parser('report', help="flag regressions of a run against a baseline")
+    report_parser.add_argument('--run', help="run to check (default: latest)")
+    report_parser.add_argument('--baseline', help="run to compare with (default: the run before)")
+    report_parser.add_argument('--time-threshold', type=float, default=20.0, help="compile time increase in percent (default: %(default)s)")
+    report_parser.add_argument('--size-threshold', type=float, default=1.0, help="program or data size increase in percent (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.command == 'runs':
+        for run, records in load_runs(args.history).items():
+            print("{} commit {} jobs {} total {:.2f}s".format(run, records[0].get('commit'), len(records), sum(record['duration'] for record in records)))
+    else:
+        sys.exit(1 if report(args.history, args.run, args.baseline, args.time_threshold, args.size_threshold) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import os
+import json
+
+# Estimate for jobs that have never been timed, when no other job has been either
+DEFAULT_DURATION = 10.0
+
+def index_examples(libraries_directory='libraries'):
+    """
+    Walk the libraries tree once, collecting every example sketch and the test markers next to it.
+
+    Hidden directories and files are ignored, as glob('libraries/**/*.ino') does.
+
+    Returns:
+        tuple: The sorted sketch paths, and for each sketch directory the set of its marker file names
+        such as '.all.test.skip' or '.metro_m0.test.only'.
+    """
+    sketches = []
+    markers = {}
+    for dirpath, dirnames, filenames in os.walk(libraries_directory):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        for name in filenames:
+            if name.endswith('.ino') and not name.startswith('.'):
+                sketches.append(os.path.join(dirpath, name))
+            elif name.endswith(('.test.skip', '.test.only')):
+                markers.setdefault(dirpath, set()).add(name)
+    sketches.sort()
+    return sketches, markers
+
+def is_skipped(sketch, variant, tinyusb, markers):
+    """Apply the .test.skip/.test.only markers and the USB stack rules to one sketch and board."""
+    sketch_markers = markers.get(os.path.dirname(sketch), ())
+    # Skip if contains: ".board.test.skip" or ".all.test.skip"
+    if '.all.test.skip' in sketch_markers or '.' + variant + '.test.skip' in sketch_markers:
+        return True
+    # Skip if not contains: ".board.test.only" for a specific board
+    if any(name.endswith('.test.only') for name in sketch_markers) and '.' + variant + '.test.only' not in sketch_markers:
+        return True
+    # skip non-tinyusb variant for tinyusb examples
+    if not tinyusb and "libraries/Adafruit_TinyUSB_Arduino" in sketch:
+        return True
+    # skip -tinyusb variant for USBHost examples
+    if tinyusb and "libraries/USBHost" in sketch:
+        return True
+    return False
+
+def parse_shard(value):
+    """Parse a shard spec such as '2/4' into the 1-based shard index and the shard count."""
+    index, _, count = value.partition('/')
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError("shard {} is not between 1 and {}".format(index, count))
+    return index, count
+
+def load_durations(file_path):
+    if not file_path or not os.path.exists(file_path):
+        return {}
+    with open(file_path) as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return {}
+
+def assign_shards(jobs, count, durations, key):
+    """
+    Assign every job a 1-based 'shard' so the shards take about the same time to build.
+
+    Jobs are placed longest first on the shard with the least estimated work. Untimed jobs are estimated with the
+    median recorded duration, and skipped jobs weigh nothing. Ties are broken by matrix order, so every build
+    machine computes the same assignment from the same durations.
+
+    Args:
+        jobs (list): The jobs to assign.
+        count (int): The number of shards.
+        durations (dict): The recorded duration in seconds of each job, by key(job).
+        key: Returns the durations key of a job.
+    """
+    known = sorted(durations.values())
+    estimate = known[len(known) // 2] if known else DEFAULT_DURATION
+    for job in jobs:
+        job['duration'] = 0.0 if job['skipped'] else durations.get(key(job), estimate)
+
+    loads = [0.0] * count
+    for index in sorted(range(len(jobs)), key=lambda index: (-jobs[index]['duration'], index)):
+        shard = min(range(count), key=lambda shard: (loads[shard], shard))
+        loads[shard] += jobs[index]['duration']
+        jobs[index]['shard'] = shard + 1
+    return loads
+
+def menu_variants(boards, board_ids, menu_ids):
+    """
+    Expand the given menus of each board into every combination of their options, as board specs for plan_jobs.
+
+    Menus a board does not define are ignored, and its other menus keep their default option.
+
+    Args:
+        boards (Properties): The parsed boards.txt.
+        board_ids (list): The boards to expand.
+        menu_ids (list): The menus to expand, e.g. ['opt', 'speed'].
+
+    Returns:
+        list: Board specs such as 'metro_m4:opt=fast,speed=180'.
+    """
+    variants = []
+    for board_id in board_ids:
+        board_menus = boards.menus(board_id)
+        combinations = [[]]
+        for menu_id in menu_ids:
+            if menu_id in board_menus:
+                combinations = [combination + ['{}={}'.format(menu_id, option)] for combination in combinations for option in board_menus[menu_id]]
+        variants.extend('{}:{}'.format(board_id, ','.join(combination)) if combination else board_id for combination in combinations)
+    return variants
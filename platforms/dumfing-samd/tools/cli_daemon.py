@@ -0,0 +1,124 @@
+"""
+Compile backend that keeps one `arduino-cli daemon` running and sends every compile through its gRPC API.
+
+A fresh `arduino-cli compile` process loads the configuration, package index and platforms and discovers the
+libraries before it compiles anything. The daemon does that once for its instance, which is then reused by every job.
+
+Needs grpcio and the Python stubs generated from arduino-cli's rpc/cc/arduino/cli/commands/v1/*.proto, e.g.
+
+    python -m grpc_tools.protoc -I rpc --python_out=stubs --grpc_python_out=stubs rpc/cc/arduino/cli/commands/v1/*.proto
+
+with the output directory on PYTHONPATH or in ARDUINO_CLI_STUBS. DaemonBackend.start() returns False when either is
+missing or the daemon does not come up, and build_all.py falls back to running arduino-cli per job. When the daemon
+fails during the build, the job and every later one are compiled by the fallback backend instead.
+"""
+import os
+import sys
+import threading
+import subprocess
+
+if os.environ.get('ARDUINO_CLI_STUBS'):
+    sys.path.insert(0, os.environ['ARDUINO_CLI_STUBS'])
+
+try:
+    import grpc
+    from cc.arduino.cli.commands.v1 import commands_pb2, commands_pb2_grpc, compile_pb2
+except ImportError:
+    grpc = None
+
+DAEMON_PORT = int(os.environ.get('ARDUINO_DAEMON_PORT', 50051))
+DAEMON_START_TIMEOUT = 15
+# gRPC statuses of a daemon that went away, as opposed to a sketch that failed to build
+DAEMON_FAILURE_CODES = ('UNAVAILABLE', 'CANCELLED', 'DEADLINE_EXCEEDED')
+
+class DaemonBackend:
+    """
+    A running `arduino-cli daemon` and the initialized instance shared by all compiles.
+
+    compile() has the same signature and result as build_all.run_arduino_cli and is safe to call from several
+    threads at once. The jobs the daemon fails on are compiled by fallback, with the same signature, and their
+    results carry the daemon's error as 'daemon_error'.
+    """
+    def __init__(self, port=DAEMON_PORT, fallback=None):
+        self.port = port
+        self.fallback = fallback
+        self.process = None
+        self.channel = None
+        self.stub = None
+        self.instance = None
+        # the first daemon failure, after which every job goes to the fallback
+        self.error = None
+        self.error_lock = threading.Lock()
+
+    def start(self):
+        """Start the daemon and initialize an instance. Returns whether the backend is usable."""
+        if grpc is None:
+            print("arduino-cli daemon backend needs grpcio and the arduino-cli gRPC stubs, using subprocesses")
+            return False
+        try:
+            self.process = subprocess.Popen(['arduino-cli', 'daemon', '--port', str(self.port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.channel = grpc.insecure_channel('127.0.0.1:{}'.format(self.port))
+            grpc.channel_ready_future(self.channel).result(timeout=DAEMON_START_TIMEOUT)
+            self.stub = commands_pb2_grpc.ArduinoCoreServiceStub(self.channel)
+            self.instance = self.stub.Create(commands_pb2.CreateRequest()).instance
+            for response in self.stub.Init(commands_pb2.InitRequest(instance=self.instance)):
+                if 'error' in response.DESCRIPTOR.fields_by_name and response.HasField('error'):
+                    print("arduino-cli daemon: {}".format(response.error.message))
+        except (OSError, grpc.RpcError, grpc.FutureTimeoutError) as e:
+            print("arduino-cli daemon unavailable ({}), using subprocesses".format(e.__class__.__name__))
+            self.stop()
+            return False
+        return True
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.close()
+            self.channel = None
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+    def compile(self, fqbn, sketch, build_path, core_cache=None, build_properties=()):
+        """Compile one sketch through the daemon, collecting its output streams and section sizes."""
+        if self.error is not None and self.fallback is not None:
+            return self.compile_fallback(fqbn, sketch, build_path, core_cache, build_properties)
+        request = compile_pb2.CompileRequest(instance=self.instance, fqbn=fqbn, sketch_path=os.path.abspath(sketch),
+                                             build_path=os.path.abspath(build_path), warnings='all')
+        if core_cache:
+            request.build_cache_path = os.path.abspath(core_cache)
+        request.build_properties.extend(build_properties)
+
+        stdout, stderr, sections = [], [], []
+        try:
+            for response in self.stub.Compile(request):
+                stdout.append(response.out_stream)
+                stderr.append(response.err_stream)
+                # arduino-cli 1.x moved the sizes into a final result message
+                if 'result' in response.DESCRIPTOR.fields_by_name:
+                    sections.extend(response.result.executable_sections_size)
+                else:
+                    sections.extend(response.executable_sections_size)
+        except grpc.RpcError as e:
+            if e.code().name in DAEMON_FAILURE_CODES or self.process.poll() is not None:
+                with self.error_lock:
+                    if self.error is None:
+                        self.error = "{}: {}".format(e.code().name, e.details())
+                        print("arduino-cli daemon failed ({})".format(self.error))
+                if self.fallback is not None:
+                    return self.compile_fallback(fqbn, sketch, build_path, core_cache, build_properties)
+            stdout.append((e.details() or str(e)).encode() + b'\n')
+            return {'returncode': 1, 'stdout': b''.join(stdout), 'stderr': b''.join(stderr), 'program_size': None, 'data_size': None}
+
+        sizes = {section.name: section.size for section in sections}
+        return {'returncode': 0, 'stdout': b''.join(stdout), 'stderr': b''.join(stderr),
+                'program_size': sizes.get('text'), 'data_size': sizes.get('data')}
+
+    def compile_fallback(self, fqbn, sketch, build_path, core_cache=None, build_properties=()):
+        """Compile one sketch with the fallback backend after the daemon failed."""
+        result = self.fallback(fqbn, sketch, build_path, core_cache, build_properties)
+        result['daemon_error'] = self.error
+        return result
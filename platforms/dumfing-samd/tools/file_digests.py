@@ -0,0 +1,131 @@
+"""
+Content digests of the platform sources, cached between runs, and Merkle hashes of source trees.
+
+platform_archive.py at the repository root builds the release archives with these, so a tree hashes the same here as
+in the release archives. It must not import anything from outside the platform tools.
+"""
+import os
+import os.path as path
+import stat
+import json
+import hashlib
+import tempfile
+from fnmatch import fnmatch
+from typing import List, Tuple
+
+# Same exclusions as extras/pack.release.bash (tar --exclude=extras/** --exclude=.git* --exclude=.idea),
+# plus the local build cache of tools/build_all.py and the Python bytecode its tools leave behind
+EXCLUDED_NAMES = ('.git*', '.idea', '.build_cache', '__pycache__', '*.pyc')
+EXCLUDED_DIRECTORIES = ('extras',)
+
+def is_excluded(name: str, is_directory: bool):
+    """
+    Returns whether a directory entry is left out of release archives.
+
+    Args:
+        name (str): The base name of the entry.
+        is_directory (bool): Whether the entry is a directory.
+    """
+    if is_directory and name in EXCLUDED_DIRECTORIES:
+        return True
+    return any(fnmatch(name, pattern) for pattern in EXCLUDED_NAMES)
+
+def write_atomic(file_path: str, data: bytes):
+    """
+    Writes data to a temporary file next to file_path and renames it into place.
+    """
+    directory = path.dirname(file_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+class DigestCache:
+    """
+    Remembers the SHA-256 of each file keyed by its stat data so unchanged files are not read again on the next run.
+    """
+    def __init__(self, cache_file: str = None):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.dirty = False
+        if cache_file and path.exists(cache_file):
+            with open(cache_file) as f:
+                try:
+                    self.entries = json.load(f)
+                except ValueError:
+                    self.entries = {}
+
+    def digest(self, file_path: str, file_stat: os.stat_result):
+        """
+        Returns the hex SHA-256 of a file, reusing the recorded digest if its size, mtime, ctime and inode are unchanged.
+        """
+        signature = [file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ctime_ns, file_stat.st_ino]
+        entry = self.entries.get(file_path)
+        if entry is not None and entry[:4] == signature:
+            return entry[4]
+
+        with open(file_path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        self.entries[file_path] = signature + [digest]
+        self.dirty = True
+        return digest
+
+    def save(self):
+        if self.cache_file and self.dirty:
+            write_atomic(self.cache_file, json.dumps(self.entries).encode())
+            self.dirty = False
+
+def normalized_mode(file_stat: os.stat_result):
+    """
+    Returns the permission bits stored in release archives: 755 for directories and executables, 644 otherwise.
+    """
+    if stat.S_ISDIR(file_stat.st_mode) or file_stat.st_mode & stat.S_IXUSR:
+        return 0o755
+    return 0o644
+
+def hash_tree(directory: str, digests: DigestCache, relative_path: str = '', split: Tuple[str, ...] = ()) -> Tuple[str, List[Tuple[str, str, os.stat_result]]]:
+    """
+    Computes a Merkle hash of a directory tree, honouring the archive exclusions.
+
+    Each directory hashes the sorted list of its entries' names, normalized modes and digests,
+    so any change to file contents, names or executable bits changes the root hash.
+
+    Args:
+        directory (str): The directory to hash.
+        digests (DigestCache): The cache used to look up file digests.
+        relative_path (str): The path of directory relative to the root being hashed.
+        split (tuple): Top level directories packaged separately, left out of the tree.
+
+    Returns:
+        tuple: The hex digest of the tree and the sorted list of (relative path, full path, stat) entries it contains.
+    """
+    tree = hashlib.sha256()
+    entries = []
+    with os.scandir(directory) as it:
+        children = sorted(it, key=lambda entry: entry.name)
+
+    for child in children:
+        child_stat = child.stat(follow_symlinks=False)
+        is_directory = stat.S_ISDIR(child_stat.st_mode)
+        if is_excluded(child.name, is_directory) or is_directory and not relative_path and child.name in split:
+            continue
+
+        child_relative_path = f"{relative_path}{child.name}"
+        entries.append((child_relative_path, child.path, child_stat))
+        if is_directory:
+            digest, child_entries = hash_tree(child.path, digests, child_relative_path + '/')
+            entries.extend(child_entries)
+            kind = 'tree'
+        elif stat.S_ISLNK(child_stat.st_mode):
+            digest = hashlib.sha256(os.readlink(child.path).encode()).hexdigest()
+            kind = 'link'
+        else:
+            digest = digests.digest(child.path, child_stat)
+            kind = 'blob'
+        tree.update(f"{kind} {normalized_mode(child_stat):o} {child.name}\0{digest}\n".encode())
+    return tree.hexdigest(), entries
@@ -0,0 +1,159 @@
+"""
+Waits for changes under a set of directories, using inotify on Linux and polling elsewhere.
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+POLL_INTERVAL = 1.0
+
+def load_inotify():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+class FileWatcher:
+    """
+    Reports the files changed under some directories.
+
+    Args:
+        directories (list): Directories watched with all their subdirectories.
+        files (list): Single files watched through their parent directory.
+    """
+    def __init__(self, directories, files=()):
+        self.directories = [directory for directory in directories if os.path.isdir(directory)]
+        self.files = {os.path.normpath(file_path) for file_path in files}
+        self.libc = load_inotify()
+        self.fd = None
+        self.watches = {}
+        self.snapshot = None
+        if self.libc is not None:
+            self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+            if self.fd < 0:
+                self.libc = None
+        if self.libc is not None:
+            for directory in self.directories:
+                self.watch_tree(directory)
+            for parent in {os.path.dirname(file_path) or '.' for file_path in self.files}:
+                self.watch(parent)
+        else:
+            self.snapshot = self.scan()
+
+    @property
+    def method(self):
+        return 'inotify' if self.libc is not None else 'polling'
+
+    def watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+        elif ctypes.get_errno() == errno.ENOSPC:
+            print("inotify watch limit reached, raise fs.inotify.max_user_watches to watch {}".format(directory))
+
+    def watch_tree(self, directory):
+        for dirpath, dirnames, _ in os.walk(directory):
+            self.watch(dirpath)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def is_watched(self, file_path):
+        file_path = os.path.normpath(file_path)
+        return file_path in self.files or any(file_path.startswith(directory.rstrip(os.sep) + os.sep) for directory in self.directories)
+
+    def scan(self):
+        snapshot = {}
+        for directory in self.directories:
+            for dirpath, _, filenames in os.walk(directory):
+                for name in filenames:
+                    file_path = os.path.join(dirpath, name)
+                    try:
+                        file_stat = os.stat(file_path)
+                    except OSError:
+                        continue
+                    snapshot[file_path] = (file_stat.st_mtime_ns, file_stat.st_size)
+        for file_path in self.files:
+            if os.path.exists(file_path):
+                file_stat = os.stat(file_path)
+                snapshot[file_path] = (file_stat.st_mtime_ns, file_stat.st_size)
+        return snapshot
+
+    def read_events(self, timeout):
+        """Return the paths changed within timeout seconds, or an empty set if nothing changed."""
+        if self.libc is None:
+            time.sleep(timeout)
+            snapshot = self.scan()
+            changed = {file_path for file_path in snapshot.keys() | self.snapshot.keys() if snapshot.get(file_path) != self.snapshot.get(file_path)}
+            self.snapshot = snapshot
+            return changed
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0').decode(errors='replace')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, report every watched directory as changed
+                changed.update(self.directories)
+                changed.update(self.files)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            file_path = os.path.normpath(os.path.join(directory, name))
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch_tree(file_path)
+            if self.is_watched(file_path):
+                changed.add(file_path)
+        return changed
+
+    def wait(self, debounce=0.3):
+        """
+        Block until something changes, then keep collecting changes until none arrive for debounce seconds.
+
+        Returns:
+            set: The changed paths, relative to the watched roots as given.
+        """
+        changed = set()
+        while not changed:
+            changed = self.read_events(POLL_INTERVAL if self.libc is None else None)
+        while True:
+            more = self.read_events(max(debounce, POLL_INTERVAL) if self.libc is None else debounce)
+            if not more:
+                return changed
+            changed |= more
@@ -1,221 +1,176 @@
 #!/usr/bin/env python3
-
-print('''# Copyright (c) 2014-2015 Arduino LLC.  All right reserved.
-#
-# This library is free software; you can redistribute it and/or
-# modify it under the terms of the GNU Lesser General Public
-# License as published by the Free Software Foundation; either
-# version 2.1 of the License, or (at your option) any later version.
-#
-# This library is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
-# See the GNU Lesser General Public License for more details.
-#
-# You should have received a copy of the GNU Lesser General Public
-# License along with this library; if not, write to the Free Software
-# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
-''')
-
-mcu_dict = {
-    'SAMD21': {
-        'flash_size': 262144,
-        'data_size': 0,
-        'offset': '0x2000',
-        'build_mcu': 'cortex-m0plus',
-        'f_cpu': '48000000L',
-        'extra_flags': '-DARDUINO_SAMD_ZERO -DARM_MATH_CM0PLUS',
-        'openocdscript': 'scripts/openocd/daplink_samd21.cfg',
-    },
-
-    'SAMD51': {
-        'flash_size': 507904, # SAMD51P20A and SAMD51J20A has 1032192
-        'data_size': 0,
-        'offset': '0x4000',
-        'build_mcu': 'cortex-m4',
-        'f_cpu': '120000000L',
-        'extra_flags': '-D__SAMD51__ -D__FPU_PRESENT -DARM_MATH_CM4 -mfloat-abi=hard -mfpu=fpv4-sp-d16',
-        'openocdscript': 'scripts/openocd/daplink_samd51.cfg',
-    },
-
-    'SAME51': {
-        'flash_size': 507904,
-        'data_size': 0,
-        'offset': '0x4000',
-        'build_mcu': 'cortex-m4',
-        'f_cpu': '120000000L',
-        'extra_flags': '-D__SAMD51__ -D__FPU_PRESENT -DARM_MATH_CM4 -mfloat-abi=hard -mfpu=fpv4-sp-d16',
-        'openocdscript': 'scripts/openocd/daplink_samd51.cfg',
-    },
-}
-
-
-def build_header(mcu, name, vendor, product, vid, pid_list):
-    prettyname = f"{vendor} {product} ({mcu})"
-    print()
-    print("# -----------------------------------")
-    print(f"# {prettyname}")
-    print("# -----------------------------------")
-    print(f"{name}.name={prettyname}")
-    print()
-
-    print("# VID/PID for Bootloader, Arduino & CircuitPython")
-    for i in range(len(pid_list)):
-        print(f"{name}.vid.{i}={vid}")
-        print(f"{name}.pid.{i}={pid_list[i]}")
-    print()
-
-
-def build_upload(mcu, name, extra_flags):
-    print("# Upload")    
-    print(f"{name}.upload.tool=bossac18")
-    print(f"{name}.upload.protocol=sam-ba")
-    
-    if ('SAMD51P20A' in extra_flags) or ('SAMD51J20A' in extra_flags):
-        flash_size = 1032192
+import os
+import sys
+import json
+import difflib
+import hashlib
+import argparse
+
+import chevron
+
+from file_digests import write_atomic
+
+TOOLS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BOARDS_TABLE = os.path.join(TOOLS_DIRECTORY, 'boards.json')
+BOARDS_TEMPLATE = os.path.join(TOOLS_DIRECTORY, 'boards.txt.mustache')
+# Records the inputs and output of the last generation, to skip it when nothing changed
+STAMP_FILE = os.path.join(os.environ.get('BUILD_CACHE_DIR', '.build_cache'), 'makeboards.json')
+
+# Due to fastLed issue https://github.com/FastLED/FastLED/issues/1363
+# although there is a simple fix already https://github.com/FastLED/FastLED/pull/1424
+# fastLED is not well maintained, and we need to skip ARDUINO_SAMD_ZERO for affected boards
+# in the long run we should move all of our libraries away from ARDUINO_SAMD_ZERO
+# dmfg_gc_v3_m0 has never defined it
+NO_SAMD_ZERO_VARIANTS = ['gemma_m0', 'trinket_m0', 'qtpy_m0', 'itsybitsy_m0', 'dmfg_gc_v3_m0']
+# These parts have twice the flash of the rest of their family
+LARGE_FLASH_PARTS = ['SAMD51P20A', 'SAMD51J20A']
+LARGE_FLASH_SIZE = 1032192
+
+
+def load_table(table_file=BOARDS_TABLE):
+    with open(table_file) as f:
+        return json.load(f)
+
+
+def board_context(board, mcus):
+    """
+    Derive the values the template prints for one board entry of boards.json.
+
+    The board name defaults to the vendor, product and MCU, and the heading of its section to the board name. A
+    board entry can set 'prettyname' and 'heading' to override them.
+    """
+    mcu = mcus[board['mcu']]
+    if any(part in board['extra_flags'] for part in LARGE_FLASH_PARTS):
+        flash_size = LARGE_FLASH_SIZE
     else:
-        flash_size = mcu_dict[mcu]['flash_size']
-    print(f"{name}.upload.maximum_size={flash_size}")
-    #print(f"{name}.upload.maximum_data_size={mcu_dict[mcu]['data_size']}")
-    
-    print(f"{name}.upload.offset={mcu_dict[mcu]['offset']}")
-    print(f"{name}.upload.use_1200bps_touch=true")
-    print(f"{name}.upload.wait_for_upload_port=true")
-    print(f"{name}.upload.native_usb=true")
-    print()
-
-
-def build_build(mcu, name, variant, vendor, product, vid, pid_list, boarddefine, extra_flags, bootloader):
-    mcu_properties = mcu_dict[mcu]
-
-    print("# Build")
-    print(f"{name}.build.mcu={mcu_properties['build_mcu']}")
-    print(f"{name}.build.f_cpu={mcu_properties['f_cpu']}")
-    print(f'{name}.build.usb_product="{product}"')
-    print(f'{name}.build.usb_manufacturer="{vendor}"')
-    print(f"{name}.build.board={boarddefine}")
-    print(f"{name}.build.core=arduino")
-
-    # Due to fastLed issue https://github.com/FastLED/FastLED/issues/1363
-    # although there is a simple fix already https://github.com/FastLED/FastLED/pull/1424
-    # fastLED is not well maintained, and we need to skip ARDUINO_SAMD_ZERO for affected boards
-    # in the long run we should move all of our libraries away from ARDUINO_SAMD_ZERO
-    if variant in [ 'gemma_m0', 'trinket_m0', 'qtpy_m0', 'itsybitsy_m0' ]:
-        print(f"{name}.build.extra_flags={extra_flags} -DARM_MATH_CM0PLUS {{build.usb_flags}}")
+        flash_size = mcu['flash_size']
+    if board['variant'] in NO_SAMD_ZERO_VARIANTS:
+        build_flags = f"{board['extra_flags']} -DARM_MATH_CM0PLUS"
     else:
-        print(f"{name}.build.extra_flags={extra_flags} {mcu_properties['extra_flags']} {{build.usb_flags}}")
-
-    print(f"{name}.build.ldscript=linker_scripts/gcc/flash_with_bootloader.ld")
-    print(f"{name}.build.openocdscript={mcu_properties['openocdscript']}")
-    print(f"{name}.build.variant={variant}")
-    print(f"{name}.build.variant_system_lib=")
-    print(f"{name}.build.vid={vid}")
-    print(f"{name}.build.pid={pid_list[0]}")
-    print(f"{name}.bootloader.tool=openocd")
-    print(f"{name}.bootloader.file={bootloader}")
-    if (mcu == 'SAMD51' or mcu == 'SAME51'):
-        print(f'{name}.compiler.arm.cmsis.ldflags="-L{{runtime.tools.CMSIS-5.4.0.path}}/CMSIS/Lib/GCC/" "-L{{build.variant.path}}" -larm_cortexM4lf_math -mfloat-abi=hard -mfpu=fpv4-sp-d16')
-    print()
-    
-
-def build_menu(mcu, name):
-    if (mcu == 'SAMD51' or mcu == 'SAME51'):
-        print("# Menu: Cache")
-        print(f"{name}.menu.cache.on=Enabled")
-        print(f"{name}.menu.cache.on.build.cache_flags=-DENABLE_CACHE")
-        print(f"{name}.menu.cache.off=Disabled")
-        print(f"{name}.menu.cache.off.build.cache_flags=")
-        print()
-
-        print("# Menu: Speed")
-        print(f"{name}.menu.speed.120=120 MHz (standard)")
-        print(f"{name}.menu.speed.120.build.f_cpu=120000000L")
-        print(f"{name}.menu.speed.150=150 MHz (overclock)")
-        print(f"{name}.menu.speed.150.build.f_cpu=150000000L")
-        print(f"{name}.menu.speed.180=180 MHz (overclock)")
-        print(f"{name}.menu.speed.180.build.f_cpu=180000000L")
-        print(f"{name}.menu.speed.200=200 MHz (overclock)")
-        print(f"{name}.menu.speed.200.build.f_cpu=200000000L")
-        print()
-
-    print("# Menu: Optimization")
-    print(f"{name}.menu.opt.small=Small (-Os) (standard)")
-    print(f"{name}.menu.opt.small.build.flags.optimize=-Os")
-    print(f"{name}.menu.opt.fast=Fast (-O2)")
-    print(f"{name}.menu.opt.fast.build.flags.optimize=-O2")
-    print(f"{name}.menu.opt.faster=Faster (-O3)")
-    print(f"{name}.menu.opt.faster.build.flags.optimize=-O3")
-    print(f"{name}.menu.opt.fastest=Fastest (-Ofast)")
-    print(f"{name}.menu.opt.fastest.build.flags.optimize=-Ofast")
-    print(f"{name}.menu.opt.dragons=Here be dragons (-Ofast -funroll-loops)")
-    print(f"{name}.menu.opt.dragons.build.flags.optimize=-Ofast -funroll-loops")
-    print()
-    
-    if (mcu == 'SAMD51' or mcu == 'SAME51'):
-        print("# Menu: QSPI Speed")
-        print(f"{name}.menu.maxqspi.50=50 MHz (standard)")
-        print(f"{name}.menu.maxqspi.50.build.flags.maxqspi=-DVARIANT_QSPI_BAUD_DEFAULT=50000000")
-        print(f"{name}.menu.maxqspi.fcpu=CPU Speed / 2")
-        print(f"{name}.menu.maxqspi.fcpu.build.flags.maxqspi=-DVARIANT_QSPI_BAUD_DEFAULT=({{build.f_cpu}})")
-        print()
-
-    print("# Menu: USB Stack")
-    print(f"{name}.menu.usbstack.arduino=Arduino")
-    print(f"{name}.menu.usbstack.tinyusb=TinyUSB")
-    print(f"{name}.menu.usbstack.tinyusb.build.flags.usbstack=-DUSE_TINYUSB")
-    print()
-
-    print("# Menu: Debug")
-    print(f"{name}.menu.debug.off=Off")
-    print(f"{name}.menu.debug.on=On")
-    print(f"{name}.menu.debug.on.build.flags.debug=-g")
-    print()
-
-    # comment out for now since debugger selection does not work, debug does not pickup the right openocd script
-    # print("# Menu: Debugger")
-    # script_mcu = 'samd21' if mcu == 'SAMD21' else 'samd51'
-    # print(f"{name}.menu.debugger.daplink=CMSIS-DAP (DAPLink)")
-    # print(f"{name}.menu.debugger.daplink.build.openocdscript=scripts/openocd/daplink_{script_mcu}.cfg")
-    # print(f"{name}.menu.debugger.jlink=J-Link")
-    # print(f"{name}.menu.debugger.jlink.build.openocdscript=scripts/openocd/jlink_{script_mcu}.cfg")
-
-
-def build_global_menu():
-    print("menu.cache=Cache")
-    print("menu.speed=CPU Speed")
-    print("menu.opt=Optimize")
-    print("menu.maxqspi=Max QSPI")    
-    print("menu.usbstack=USB Stack")
-    print("menu.debug=Debug")
-    #print("menu.debugger=Debugger")
-
-
-def make_board(mcu, name, variant, vendor, product, vid, pid_list, boarddefine, extra_flags, bootloader):
-    build_header(mcu, name, vendor, product, vid, pid_list)
-    build_upload(mcu, name, extra_flags)
-    build_build(mcu, name, variant, vendor, product, vid, pid_list, boarddefine, extra_flags, bootloader)    
-    build_menu(mcu, name)
+        build_flags = f"{board['extra_flags']} {mcu['extra_flags']}"
+    prettyname = board.get('prettyname', f"{board['vendor']} {board['product']} ({board['mcu']})")
+    return {
+        **board,
+        'mcu': mcu,
+        'prettyname': prettyname,
+        'heading': board.get('heading', prettyname),
+        'pids': [{'index': index, 'pid': pid} for index, pid in enumerate(board['pids'])],
+        'pid': board['pids'][0],
+        'flash_size': flash_size,
+        'build_flags': build_flags,
+    }
+
+
+def render_boards(table, template):
+    """
+    Render boards.txt for every board of the table.
+
+    Args:
+        table (dict): The parsed boards.json, with the 'mcus' and the 'boards' to generate.
+        template (str): The boards.txt Mustache template.
+
+    Returns:
+        str: The contents of boards.txt.
+    """
+    # tokenize once, chevron renders a token list without parsing the template again for every board
+    tokens = list(chevron.tokenizer.tokenize(template))
+    rendered = chevron.render(tokens, {'boards': [board_context(board, table['mcus']) for board in table['boards']]})
+    # the shipped boards.txt has no newline after its last line
+    return rendered.rstrip('\n')
+
+
+def make_boards(table_file=BOARDS_TABLE, template_file=BOARDS_TEMPLATE):
+    with open(template_file) as f:
+        template = f.read()
+    return render_boards(load_table(table_file), template)
+
+
+def inputs_hash(*file_paths):
+    """Hash the generator, its table and its template, which together determine boards.txt."""
+    inputs = hashlib.sha256()
+    for file_path in (os.path.abspath(__file__),) + file_paths:
+        with open(file_path, 'rb') as f:
+            inputs.update(hashlib.sha256(f.read()).digest())
+    return inputs.hexdigest()
+
+
+def file_hash(file_path):
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_stamp(stamp_file):
+    if not os.path.exists(stamp_file):
+        return {}
+    with open(stamp_file) as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return {}
+
+
+def write_boards(output_file, table_file=BOARDS_TABLE, template_file=BOARDS_TEMPLATE, stamp_file=STAMP_FILE, force=False):
+    """
+    Generate boards.txt unless neither its inputs nor the last generated file changed since the last run.
+
+    Returns:
+        bool: Whether the file was written.
+    """
+    inputs = inputs_hash(table_file, template_file)
+    stamp = load_stamp(stamp_file).get(os.path.abspath(output_file), {})
+    if not force and stamp.get('inputs') == inputs and stamp.get('output') == file_hash(output_file):
+        return False
+
+    data = make_boards(table_file, template_file).encode()
+    write_atomic(output_file, data)
+
+    stamps = load_stamp(stamp_file)
+    stamps[os.path.abspath(output_file)] = {'inputs': inputs, 'output': hashlib.sha256(data).hexdigest()}
+    os.makedirs(os.path.dirname(stamp_file) or '.', exist_ok=True)
+    write_atomic(stamp_file, json.dumps(stamps, indent=1, sort_keys=True).encode())
+    return True
+
+
+def diff_boards(boards_file, table_file=BOARDS_TABLE, template_file=BOARDS_TEMPLATE):
+    """Return the unified diff from an existing boards.txt to the generated one, empty when they are identical."""
+    with open(boards_file, newline='') as f:
+        existing = f.read()
+    generated = make_boards(table_file, template_file)
+    return list(difflib.unified_diff(existing.splitlines(keepends=True), generated.splitlines(keepends=True), boards_file, 'generated'))
+
+
+def check_boards(boards_file):
+    """Compare the generated boards.txt byte for byte with an existing one and print the differences."""
+    diff = diff_boards(boards_file)
+    for line in diff:
+        sys.stdout.write(line if line.endswith('\n') else line + '\n\\ No newline at end of file\n')
+    differences = sum(1 for line in diff[2:] if line[0] in '+-')
+    print(f"{differences} line(s) differ")
+    return differences
 
 
 # ------------------------------
 # main
 # ------------------------------
 
-build_global_menu()
-
-# ------------------------------
-# SAM D21 (M0)
-# ------------------------------
-
-# name, variant, vendor, product, vid, pid_list, boarddefine, extra_flags, bootloader
-# try to sort in Alphabetical order
-d21_board_list = [
-    ["dmfg_gc_v3", "dmfg_gc_v3_m0", "Dumfing", "DMFG GroundController V3",
-     "0x239A", ["0x800B", "0x000B", "0x0015"],
-     "SAMD_ZERO", "-D__SAMD21G18A__ -DADAFRUIT_FEATHER_M0",
-     "featherM0/bootloader-feather_m0-v2.0.0-adafruit.5.bin"],
+def main():
+    parser = argparse.ArgumentParser(description="Generate boards.txt from tools/boards.json and tools/boards.txt.mustache")
+    parser.add_argument('-o', '--output', default='boards.txt', help="file to write, - for stdout (default: %(default)s)")
+    parser.add_argument('--force', action='store_true', help="generate even if the inputs did not change")
+    parser.add_argument('--check', metavar='BOARDS_FILE', help="compare the generated file with an existing boards.txt instead")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if check_boards(args.check) else 0)
+    if args.output == '-':
+        sys.stdout.write(make_boards())
+    elif write_boards(args.output, force=args.force):
+        print(f"Generated {args.output}")
+    else:
+        print(f"{args.output} is up to date")
 
-]
 
-for b in d21_board_list:
-    make_board("SAMD21", b[0], b[1], b[2], b[3], b[4], b[5], b[6], b[7], b[8])
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Parser for the Arduino platform properties format used by platform.txt, boards.txt and programmers.txt.
+
+The release scripts at the repository root load it through arduino_properties.py, so it must not import anything
+from outside the platform tools.
+
+See https://arduino.github.io/arduino-cli/0.33/platform-specification/ for the format.
+"""
+import os
+import re
+import sys
+from typing import Dict, Iterable, List, Tuple
+
+OS_SUFFIXES = ('linux', 'windows', 'macosx')
+CURRENT_OS_SUFFIX = 'windows' if sys.platform.startswith('win') else 'macosx' if sys.platform == 'darwin' else 'linux'
+VARIABLE_PATTERN = re.compile(r'\{([^{}\s]+)\}')
+MAX_EXPANSION_DEPTH = 10
+
+class Properties:
+    """
+    A parsed properties file with indexes by key prefix and, for boards.txt, by board ID.
+
+    Keys keep the order of the file. OS specific keys (key.linux, key.windows, key.macosx) for the
+    current OS override the plain key, as arduino-cli does.
+    """
+    def __init__(self, values: Dict[str, str], file_path: str = None):
+        self.file_path = file_path
+        self.values = {key: value for key, value in values.items() if key.rpartition('.')[2] not in OS_SUFFIXES}
+        for key, value in values.items():
+            base_key, _, suffix = key.rpartition('.')
+            if suffix == CURRENT_OS_SUFFIX:
+                self.values[base_key] = value
+
+        self.prefix_index: Dict[str, Dict[str, str]] = {}
+        for key, value in self.values.items():
+            head, _, rest = key.partition('.')
+            self.prefix_index.setdefault(head, {})[rest] = value
+
+    def __getitem__(self, key: str):
+        return self.values[key]
+
+    def __contains__(self, key: str):
+        return key in self.values
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key: str, default: str = None):
+        return self.values.get(key, default)
+
+    def items(self):
+        return self.values.items()
+
+    def with_prefix(self, prefix: str) -> Dict[str, str]:
+        """
+        Returns the properties under a dotted prefix with the prefix removed, e.g. with_prefix('tools.bossac').
+
+        Args:
+            prefix (str): The key prefix, without a trailing dot.
+        """
+        head, _, rest = prefix.partition('.')
+        group = self.prefix_index.get(head, {})
+        if not rest:
+            return dict(group)
+        rest += '.'
+        return {key[len(rest):]: value for key, value in group.items() if key.startswith(rest)}
+
+    @property
+    def menu_labels(self) -> Dict[str, str]:
+        """
+        The top level menu declarations of a boards.txt, e.g. {'usbstack': 'USB Stack'}.
+        """
+        return {key: value for key, value in self.prefix_index.get('menu', {}).items() if '.' not in key}
+
+    @property
+    def boards(self) -> List[str]:
+        """
+        The IDs of the boards defined in a boards.txt, in file order.
+        """
+        return [board_id for board_id, group in self.prefix_index.items() if board_id != 'menu' and 'name' in group]
+
+    def board(self, board_id: str, options: Dict[str, str] = None) -> Dict[str, str]:
+        """
+        Returns the properties of a board with the given menu options applied.
+
+        Menus the options do not mention use their first option, matching the IDE and arduino-cli defaults.
+
+        Args:
+            board_id (str): The board ID.
+            options (dict): The selected option for each menu ID, e.g. {'usbstack': 'tinyusb'}.
+
+        Returns:
+            dict: The board's own properties with the selected menu option properties merged on top.
+        """
+        if board_id not in self.prefix_index:
+            raise KeyError(f"Board {board_id} is not defined in {self.file_path or 'properties'}")
+        options = options or {}
+        group = self.prefix_index[board_id]
+        board_properties = {key: value for key, value in group.items() if not key.startswith('menu.')}
+
+        for menu_id, menu_options in self.menus(board_id).items():
+            selected = options.get(menu_id, next(iter(menu_options)))
+            if selected not in menu_options:
+                raise KeyError(f"Board {board_id} has no option {selected} for menu {menu_id}")
+            option_prefix = f"menu.{menu_id}.{selected}."
+            board_properties.update({key[len(option_prefix):]: value for key, value in group.items() if key.startswith(option_prefix)})
+        return board_properties
+
+    def menus(self, board_id: str) -> Dict[str, Dict[str, str]]:
+        """
+        Returns the menus a board defines, as {menu ID: {option ID: label}} in file order.
+        """
+        menus: Dict[str, Dict[str, str]] = {}
+        for key, value in self.prefix_index.get(board_id, {}).items():
+            parts = key.split('.')
+            if parts[0] == 'menu' and len(parts) == 3:
+                menus.setdefault(parts[1], {})[parts[2]] = value
+        return menus
+
+def expand(value: str, *scopes: Dict[str, str]) -> str:
+    """
+    Expands {variable} references in a value, looking them up in each scope in order.
+
+    Unknown variables are left in place, as arduino-cli does until they are provided at build time.
+
+    Args:
+        value (str): The value to expand.
+        scopes: Dictionaries of properties, earlier ones take precedence.
+    """
+    def lookup(match):
+        name = match.group(1)
+        for scope in scopes:
+            if name in scope:
+                return scope[name]
+        return match.group(0)
+
+    for _ in range(MAX_EXPANSION_DEPTH):
+        expanded = VARIABLE_PATTERN.sub(lookup, value)
+        if expanded == value:
+            break
+        value = expanded
+    return value
+
+def parse_properties(lines: Iterable[str], file_path: str = None) -> Properties:
+    """
+    Parses the lines of a properties file.
+
+    Blank lines and lines starting with '#' are ignored. Each remaining line is split on its first '='.
+    """
+    values = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        key, separator, value = line.partition('=')
+        if separator:
+            values[key.strip()] = value.strip()
+    return Properties(values, file_path)
+
+_cache: Dict[str, Tuple[Tuple[int, int], Properties]] = {}
+
+def load_properties(file_path: str) -> Properties:
+    """
+    Loads and parses a properties file, reusing the previous result while its mtime and size are unchanged.
+    """
+    file_stat = os.stat(file_path)
+    signature = (file_stat.st_mtime_ns, file_stat.st_size)
+    cached = _cache.get(file_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with open(file_path, encoding='utf-8') as f:
+        properties = parse_properties(f, file_path)
+    _cache[file_path] = (signature, properties)
+    return properties
@@ -0,0 +1,100 @@
+import os
+import re
+import hashlib
+
+from file_digests import DigestCache, hash_tree
+
+INCLUDE_PATTERN = re.compile(rb'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.MULTILINE)
+SOURCE_EXTENSIONS = ('.ino', '.pde', '.c', '.cpp', '.cc', '.h', '.hpp', '.S')
+HEADER_EXTENSIONS = ('.h', '.hpp')
+# Top level directories of a flat layout library that are not part of what a sketch compiles against
+NON_SOURCE_DIRECTORIES = ('examples', 'extras', 'docs', 'test', 'tests')
+
+def source_files(directory, skip_directories=()):
+    """List the source files under a directory in sorted order, leaving out the given top level directories."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        if dirpath == directory:
+            dirnames[:] = [name for name in dirnames if name not in skip_directories]
+        dirnames.sort()
+        files.extend(os.path.join(dirpath, name) for name in sorted(filenames) if name.endswith(SOURCE_EXTENSIONS))
+    return files
+
+def scan_includes(files):
+    """Return the names used in #include directives of the given files."""
+    names = set()
+    for file_path in files:
+        with open(file_path, 'rb') as f:
+            names.update(match.decode(errors='replace') for match in INCLUDE_PATTERN.findall(f.read()))
+    return names
+
+class SketchDependencies:
+    """
+    Resolves which bundled libraries a sketch compiles against and hashes everything it depends on.
+
+    Includes are resolved against the headers of each library under libraries/, using src/ for libraries with the
+    1.5 layout and the library root otherwise, and followed transitively through the libraries' own sources. Like
+    arduino-cli, a header provided by several libraries resolves to the library named after it.
+    """
+    def __init__(self, digests: DigestCache, libraries_directory='libraries'):
+        self.digests = digests
+        self.roots = {}
+        self.flat_layout = set()
+        self.headers = {}
+        self.library_includes = {}
+        self.library_hashes = {}
+
+        libraries = sorted(os.listdir(libraries_directory)) if os.path.isdir(libraries_directory) else []
+        for library in libraries:
+            library_path = os.path.join(libraries_directory, library)
+            if not os.path.isdir(library_path):
+                continue
+            source_path = os.path.join(library_path, 'src')
+            if os.path.isdir(source_path):
+                self.roots[library] = source_path
+            else:
+                self.roots[library] = library_path
+                self.flat_layout.add(library)
+            for file_path in self.files(library):
+                if file_path.endswith(HEADER_EXTENSIONS):
+                    header = os.path.relpath(file_path, self.roots[library]).replace(os.path.sep, '/')
+                    if header not in self.headers or os.path.splitext(header)[0] == library:
+                        self.headers[header] = library
+
+    def skipped_directories(self, library):
+        return NON_SOURCE_DIRECTORIES if library in self.flat_layout else ()
+
+    def files(self, library):
+        return source_files(self.roots[library], self.skipped_directories(library))
+
+    def resolve(self, names):
+        """Return the libraries providing the given include names, followed transitively."""
+        found = set()
+        queue = [self.headers[name] for name in names if name in self.headers]
+        while queue:
+            library = queue.pop()
+            if library in found:
+                continue
+            found.add(library)
+            if library not in self.library_includes:
+                self.library_includes[library] = scan_includes(self.files(library))
+            queue.extend(self.headers[name] for name in self.library_includes[library] if name in self.headers)
+        return found
+
+    def library_hash(self, library):
+        if library not in self.library_hashes:
+            self.library_hashes[library], _ = hash_tree(self.roots[library], self.digests, split=self.skipped_directories(library))
+        return self.library_hashes[library]
+
+    def sketch_libraries(self, sketch):
+        """Return the libraries a sketch uses, sorted by name."""
+        return sorted(self.resolve(scan_includes(source_files(os.path.dirname(sketch)))))
+
+    def sketch_hash(self, sketch):
+        """Hash the sketch directory together with the sources of every library it uses."""
+        inputs = hashlib.sha256()
+        sketch_tree, _ = hash_tree(os.path.dirname(sketch), self.digests)
+        inputs.update("sketch\0{}\n".format(sketch_tree).encode())
+        for library in self.sketch_libraries(sketch):
+            inputs.update("library {}\0{}\n".format(library, self.library_hash(library)).encode())
+        return inputs.hexdigest()
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+class Tracer:
+    """
+    Collects timing spans and counters for a release run and exports them as a Chrome trace.
+
+    Spans are recorded as complete ("X") events with wall clock timestamps, so spans measured in worker
+    processes can be merged with those of the main process. Concurrent asyncio tasks are given separate
+    lanes so overlapping spans stay readable in chrome://tracing or Perfetto.
+    """
+    def __init__(self):
+        self.events: List[dict] = []
+        self.counters: Dict[str, int] = {}
+        self.lanes: Dict[object, int] = {}
+        self.lock = threading.Lock()
+
+    def lane(self):
+        try:
+            owner = asyncio.current_task()
+        except RuntimeError:
+            owner = None
+        owner = owner or threading.get_ident()
+        with self.lock:
+            return self.lanes.setdefault(owner, len(self.lanes))
+
+    def record(self, name: str, start: float, end: float, category: str = 'stage', pid: int = None, tid: int = None, **args):
+        """
+        Records a span that has already finished.
+
+        Args:
+            name (str): The span name.
+            start (float): The start time in seconds since the epoch.
+            end (float): The end time in seconds since the epoch.
+            category (str): The span category, used to group spans in the summary.
+            pid (int): The process the span ran in. Defaults to the current process.
+            tid (int): The lane the span is drawn in. Defaults to the current task or thread.
+            args: Extra values shown with the span.
+        """
+        # lane() takes the lock itself, so resolve it first
+        tid = tid if tid is not None else self.lane()
+        with self.lock:
+            self.events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': pid if pid is not None else os.getpid(),
+                'tid': tid,
+                'args': args,
+            })
+
+    @contextmanager
+    def span(self, name: str, category: str = 'stage', **args):
+        """
+        Times the enclosed block. The yielded dict can be filled with extra values to attach to the span.
+        """
+        start = time.time()
+        tid = self.lane()
+        try:
+            yield args
+        finally:
+            self.record(name, start, time.time(), category, tid=tid, **args)
+
+    def traced(self, name: str = None, category: str = 'stage'):
+        """
+        Decorator that records a span around every call of a coroutine function.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with self.span(name or function.__name__, category):
+                    return await function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def chrome_trace(self):
+        """
+        Returns the trace in the Chrome trace event format, with the counters as a final counter event.
+        """
+        events = sorted(self.events, key=lambda event: event['ts'])
+        if events and self.counters:
+            end = max(event['ts'] + event['dur'] for event in events)
+            events.append({'name': 'counters', 'ph': 'C', 'ts': end, 'pid': os.getpid(), 'tid': 0, 'args': dict(self.counters)})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'counters': dict(self.counters)}}
+
+    def write_chrome_trace(self, file_path: str):
+        with open(file_path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        """
+        Returns a table of the total, maximum and count of each span name, followed by the counters.
+        """
+        totals: Dict[str, List[float]] = {}
+        for event in self.events:
+            entry = totals.setdefault(event['name'], [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += event['dur'] / 1e6
+            entry[2] = max(entry[2], event['dur'] / 1e6)
+
+        row_format = '| {:48} | {:>5} | {:>9} | {:>9} |'
+        lines = [row_format.format('Span', 'Count', 'Total', 'Max'), '-' * 84]
+        first_start = {}
+        for event in sorted(self.events, key=lambda event: event['ts']):
+            first_start.setdefault(event['name'], event['ts'])
+        for name in sorted(totals, key=lambda name: first_start[name]):
+            count, total, longest = totals[name]
+            lines.append(row_format.format(name[:48], count, f"{total:.3f}s", f"{longest:.3f}s"))
+        if self.counters:
+            lines.append('-' * 84)
+            for name, value in sorted(self.counters.items()):
+                lines.append('| {:48} | {:>29,} |'.format(name, value))
+        return '\n'.join(lines)
+
+tracer = Tracer()
@@ -0,0 +1,100 @@
+import os
+import random
+import asyncio
+
+import create_release
+from benchmarks.mock_github import MockGitHub
+
+def first_drop_seed(drop_rate):
+    """A seed whose first upload is dropped and whose second goes through."""
+    for seed in range(100):
+        draws = random.Random(seed)
+        if draws.random() < drop_rate <= draws.random():
+            return seed
+
+def test_upload_retry_replaces_incomplete_asset(monkeypatch):
+    async def scenario():
+        server = MockGitHub(seed=first_drop_seed(0.5), drop_rate=0.5)
+        await server.start()
+        try:
+            monkeypatch.setattr(create_release, 'API_URL', f"{server.url}/api")
+            monkeypatch.setattr(create_release, 'UPLOADS_URL', f"{server.url}/uploads")
+            release = server.add_release('v1', [])
+            async with create_release.create_session() as session:
+                asset = await create_release.upload_asset(session, 'token', release['id'], 'platform.tar.bz2', data=b'archive', backoff=0)
+            return server, release, asset
+        finally:
+            await server.stop()
+
+    server, release, asset = asyncio.run(scenario())
+    assert server.dropped_uploads == 1
+    assert server.requests['DELETE /api/releases/assets/{asset_id}'] == 1
+    assert asset['state'] == 'uploaded' and asset['size'] == len(b'archive')
+    assert [(a['name'], a['state']) for a in release['assets']] == [('platform.tar.bz2', 'uploaded')]
+
+def test_release_pages_follow_pagination(monkeypatch, tmp_path):
+    async def scenario():
+        server = MockGitHub()
+        await server.start()
+        try:
+            monkeypatch.setattr(create_release, 'API_URL', f"{server.url}/api")
+            for n in range(5):
+                server.add_release(f"v{n}", [f"1.0.{n}_{'0' * 64}_platform.tar.bz2"])
+            async with create_release.create_session() as session:
+                return await create_release.get_release_pages(session, per_page=2, cache_dir=str(tmp_path))
+        finally:
+            await server.stop()
+
+    pages = asyncio.run(scenario())
+    assert [page['last_page'] for page in pages] == [3, 3, 3]
+    assert sum(len(page['assets']) for page in pages) == 5
+
+def test_only_content_addressed_assets_are_kept(monkeypatch, tmp_path):
+    archive_name = f"1.0.0_{'0' * 64}_platform.tar.bz2"
+    # the stand-in's existing assets are empty, so these have the same size
+    for name in (archive_name, 'package_index.json'):
+        (tmp_path / name).write_bytes(b'')
+
+    async def scenario():
+        server = MockGitHub()
+        await server.start()
+        try:
+            monkeypatch.setattr(create_release, 'API_URL', f"{server.url}/api")
+            monkeypatch.setattr(create_release, 'UPLOADS_URL', f"{server.url}/uploads")
+            release = server.add_release('v1', [archive_name, 'package_index.json'])
+            async with create_release.create_session() as session:
+                existing_assets = await create_release.get_release_assets(session, 'token', release['id'])
+                for name in (archive_name, 'package_index.json'):
+                    info = {'filename': name, 'local_path': str(tmp_path / name), 'size': 0}
+                    await create_release.upload_archive(session, 'token', release['id'], info, existing_assets, asyncio.Semaphore(1))
+            return server
+        finally:
+            await server.stop()
+
+    server = asyncio.run(scenario())
+    assert server.requests['DELETE /api/releases/assets/{asset_id}'] == 1
+    assert server.requests['POST /uploads/releases/{release_id}/assets'] == 1
+
+def test_release_resumes_its_draft(monkeypatch, tmp_path):
+    from benchmarks.release_pipeline import make_platform
+    make_platform(os.path.join(os.path.dirname(create_release.__file__), 'platforms', 'dumfing-samd'), str(tmp_path / 'platforms' / 'synthetic'), 0.05, seed=0)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('GH_API_TOKEN', 'token')
+
+    async def scenario():
+        server = MockGitHub()
+        await server.start()
+        try:
+            monkeypatch.setattr(create_release, 'API_URL', f"{server.url}/api")
+            monkeypatch.setattr(create_release, 'UPLOADS_URL', f"{server.url}/uploads")
+            # the draft is not listed to unauthenticated requests, so the second run releases the same version again
+            await create_release.run_release()
+            await create_release.run_release()
+            return server
+        finally:
+            await server.stop()
+
+    server = asyncio.run(scenario())
+    assert len(server.releases) == 1
+    names = sorted(asset['name'] for asset in server.releases[0]['assets'])
+    assert names[-2:] == ['manifest.json', 'package_index.json'] and len(names) == 3
@@ -0,0 +1,22 @@
+import threading
+
+from release_trace import Tracer
+
+def test_record_without_tid_uses_current_lane():
+    tracer = Tracer()
+    finished = threading.Event()
+
+    def record():
+        tracer.record('stage', 0.0, 1.0)
+        finished.set()
+
+    threading.Thread(target=record, daemon=True).start()
+    assert finished.wait(5), "record() without a tid deadlocked"
+    # the first thread that records gets the first lane
+    assert tracer.events[0]['tid'] == 0
+    assert tracer.events[0]['dur'] == 1e6
+
+def test_record_with_explicit_tid():
+    tracer = Tracer()
+    tracer.record('stage', 0.0, 0.5, tid=7)
+    assert tracer.events[0]['tid'] == 7
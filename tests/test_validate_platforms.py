@@ -0,0 +1,8 @@
+from validate_platforms import is_older
+
+def test_versions_compare_like_releases():
+    # a trailing zero does not make a version newer or older
+    assert not is_older([1, 0], [1, 0, 0])
+    assert not is_older([1, 0, 0], [1, 0])
+    assert is_older([1, 0, 8], [1, 0, 9])
+    assert not is_older([1, 1], [1, 0, 9])
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Checks the platform trees for the problems that would otherwise only surface while create_release.py packs and
+uploads them, and reports all of them at once.
+
+Each platform is scanned once into an index of the files the checks look up, and the platforms are checked in
+parallel, so the whole platforms/ directory takes a fraction of a second and the check can run on every commit.
+
+Usage: python validate_platforms.py [--platforms platforms]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+import os.path as path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set
+
+from arduino_properties import Properties, load_platforms
+from package_index import load_split_packaging
+
+VERSION_PATTERN = re.compile(r'^\d+(\.\d+)*$')
+# Directories whose every file is indexed, for the board properties that name files in them
+INDEXED_DIRECTORIES = ('variants', 'bootloaders')
+# The board and MCU table tools/makeboards.py generates boards.txt from
+MAKEBOARDS = path.join('tools', 'makeboards.py')
+MAKEBOARDS_TABLE = path.join('tools', 'boards.json')
+
+def index_platform(platform_directory: str) -> Dict[str, Set[str]]:
+    """
+    Scans a platform once for everything the checks look up.
+
+    Returns:
+        dict: The names at the top level as 'top', the directories in cores/ and variants/ as 'cores' and
+        'variants', and the paths of every file under variants/ and bootloaders/, relative to the platform and with
+        '/' separators, as 'files'.
+    """
+    index = {'top': set(), 'cores': set(), 'variants': set(), 'files': set()}
+    with os.scandir(platform_directory) as entries:
+        for entry in entries:
+            index['top'].add(entry.name)
+    for directory in ('cores', 'variants'):
+        if directory in index['top']:
+            with os.scandir(path.join(platform_directory, directory)) as entries:
+                index[directory] = {entry.name for entry in entries if entry.is_dir()}
+    for directory in INDEXED_DIRECTORIES:
+        if directory not in index['top']:
+            continue
+        for dirpath, _, filenames in os.walk(path.join(platform_directory, directory)):
+            relative = path.relpath(dirpath, platform_directory).replace(os.sep, '/')
+            index['files'].update(f"{relative}/{name}" for name in filenames)
+    return index
+
+def parse_version(version: str) -> List[int]:
+    return list(map(int, version.split('.')))
+
+def version_ordering(a: List[int], b: List[int]):
+    """
+    Compares two version numbers represented as lists of integers.
+
+    Args:
+        a (list): The first version number.
+        b (list): The second version number.
+
+    Returns:
+        int: -1 if a < b, 0 if a == b, 1 if a > b.
+    """
+    for a_sub_version, b_sub_version in zip(a, b):
+        if a_sub_version < b_sub_version:
+            return -1
+        elif a_sub_version > b_sub_version:
+            return 1
+    return 0
+
+def is_older(version: List[int], released_version: List[int]):
+    """
+    Whether a version sorts before the released one, with the release's own version ordering, so 1.0 and 1.0.0 are
+    the same version.
+    """
+    return version_ordering(version, released_version) < 0
+
+def check_boards(boards: Properties, index: Dict[str, Set[str]]) -> List[str]:
+    """
+    Checks that the variant, core, linker script and bootloader every board and menu option names exist.
+
+    Values that refer to another platform (vendor:name) or to properties ({...}) are not checked.
+    """
+    errors = []
+    for board_id in boards.boards:
+        board = boards.prefix_index[board_id]
+        default_variant = board.get('build.variant', board_id)
+        for key, value in board.items():
+            if not value or '{' in value or ':' in value:
+                continue
+            where = f"boards.txt: {board_id}.{key}"
+            if key.endswith('build.variant') and value not in index['variants']:
+                errors.append(f"{where} names variant {value}, but variants/{value} does not exist")
+            elif key.endswith('build.core') and value not in index['cores']:
+                errors.append(f"{where} names core {value}, but cores/{value} does not exist")
+            elif key.endswith('bootloader.file') and f"bootloaders/{value}" not in index['files']:
+                errors.append(f"{where} names bootloaders/{value}, which does not exist")
+            elif key.endswith('build.ldscript') and default_variant in index['variants'] and f"variants/{default_variant}/{value}" not in index['files']:
+                errors.append(f"{where} names variants/{default_variant}/{value}, which does not exist")
+    return errors
+
+def check_makeboards_table(platform_directory: str, index: Dict[str, Set[str]]) -> List[str]:
+    """
+    Checks the board table of tools/makeboards.py, so boards.txt is not regenerated with variants or bootloaders
+    that do not exist, and that generating boards.txt from it reproduces the one in the platform byte for byte.
+    """
+    table_file = path.join(platform_directory, MAKEBOARDS_TABLE)
+    if not path.exists(table_file):
+        return []
+    try:
+        with open(table_file) as f:
+            table = json.load(f)
+    except ValueError as e:
+        return [f"{MAKEBOARDS_TABLE} is not valid JSON: {e}"]
+
+    errors = []
+    for board in table.get('boards', []):
+        where = f"{MAKEBOARDS_TABLE}: board {board.get('name')}"
+        if board.get('mcu') not in table.get('mcus', {}):
+            errors.append(f"{where} uses MCU {board.get('mcu')}, which the table does not define")
+        if board.get('variant') not in index['variants']:
+            errors.append(f"{where} names variant {board.get('variant')}, but variants/{board.get('variant')} does not exist")
+        if f"bootloaders/{board.get('bootloader')}" not in index['files']:
+            errors.append(f"{where} names bootloaders/{board.get('bootloader')}, which does not exist")
+
+    if 'boards.txt' in index['top'] and path.exists(path.join(platform_directory, MAKEBOARDS)):
+        # makeboards.py imports its sibling modules, so it runs as a script of the platform
+        check = subprocess.run([sys.executable, MAKEBOARDS, '--check', 'boards.txt'], cwd=platform_directory, capture_output=True, text=True)
+        if check.returncode != 0:
+            summary = (check.stdout.strip() or check.stderr.strip() or 'no output').splitlines()[-1]
+            errors.append(f"boards.txt is not what {MAKEBOARDS} generates from {MAKEBOARDS_TABLE} ({summary}), see {MAKEBOARDS} --check boards.txt")
+    return errors
+
+def check_platform(platforms_directory: str, platform: str, files: Dict[str, Properties], released_version: List[int] = None) -> List[str]:
+    """
+    Runs every check on one platform.
+
+    Args:
+        files (dict): The platform's parsed 'platform' and 'boards' files, as returned by load_platforms.
+        released_version (list): The version of the platform's latest release, if it has one.
+
+    Returns:
+        list: The problems found, each prefixed with the platform name.
+    """
+    platform_directory = path.join(platforms_directory, platform)
+    index = index_platform(platform_directory)
+    errors = []
+
+    settings = files['platform']
+    if not settings.get('name'):
+        errors.append("platform.txt has no name")
+    version = settings.get('version')
+    if version is None:
+        errors.append("platform.txt has no version")
+    elif not VERSION_PATTERN.match(version):
+        errors.append(f"platform.txt version {version} is not a dotted list of numbers")
+    elif released_version is not None and is_older(parse_version(version), released_version):
+        errors.append(f"platform.txt version {version} is older than the released {'.'.join(map(str, released_version))}")
+
+    if 'architecture.txt' not in index['top']:
+        errors.append("architecture.txt is missing")
+    else:
+        with open(path.join(platform_directory, 'architecture.txt')) as f:
+            if not f.read().strip():
+                errors.append("architecture.txt is empty")
+
+    if files['boards'] is None:
+        errors.append("boards.txt is missing")
+    elif not files['boards'].boards:
+        errors.append("boards.txt defines no boards")
+    else:
+        errors.extend(check_boards(files['boards'], index))
+
+    try:
+        split_packaging = load_split_packaging(platform_directory)
+    except ValueError as e:
+        errors.append(f"extras/split_packaging.json is not valid JSON: {e}")
+        split_packaging = {}
+    for subtree in split_packaging:
+        if subtree not in index['top']:
+            errors.append(f"extras/split_packaging.json splits out {subtree}/, which does not exist")
+
+    dependencies_file = path.join(platform_directory, 'extras', 'tools_dependencies.json')
+    if path.exists(dependencies_file):
+        try:
+            with open(dependencies_file) as f:
+                dependencies = json.load(f)
+        except ValueError as e:
+            errors.append(f"extras/tools_dependencies.json is not valid JSON: {e}")
+        else:
+            for dependency in dependencies:
+                missing = [key for key in ('packager', 'name', 'version') if not dependency.get(key)]
+                if missing:
+                    errors.append(f"extras/tools_dependencies.json entry {dependency} has no {', '.join(missing)}")
+
+    errors.extend(check_makeboards_table(platform_directory, index))
+    return [f"{platform}: {error}" for error in errors]
+
+def validate_platforms(platforms_directory: str = 'platforms', released_versions: Dict[str, List[int]] = None, max_workers=None) -> List[str]:
+    """
+    Checks every platform under a directory in parallel and collects all the problems found.
+
+    Args:
+        platforms_directory (str): The directory holding one directory per platform. Defaults to 'platforms'.
+        released_versions (dict): The latest released version of each platform, to catch versions that went
+            backwards. Defaults to not checking them.
+        max_workers (int): The number of platforms checked at once. Defaults to the ThreadPoolExecutor default.
+
+    Returns:
+        list: The problems found, in platform order. Empty if every platform can be released.
+    """
+    released_versions = released_versions or {}
+    loaded = load_platforms(platforms_directory)
+    errors = [f"{platform}: platform.txt is missing" for platform in sorted(os.listdir(platforms_directory))
+              if platform not in loaded and path.isdir(path.join(platforms_directory, platform))]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = pool.map(lambda platform: check_platform(platforms_directory, platform, loaded[platform], released_versions.get(platform)), loaded)
+        for platform_errors in results:
+            errors.extend(platform_errors)
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the platform trees before they are released")
+    parser.add_argument('--platforms', default='platforms', help="directory of the platforms (default: %(default)s)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    errors = validate_platforms(args.platforms)
+    for error in errors:
+        print(error)
+    print(f"{len(errors)} problem(s) found in {time.perf_counter() - start:.3f}s")
+    sys.exit(1 if errors else 0)
+
+if __name__ == '__main__':
+    main()